@@ -2,12 +2,41 @@
 
 import csv
 import datetime
-import matplotlib.pyplot as plt
+import logging
+import numpy as np
 import sys
 import re
 
+import colstore
+import figures
+import instrument
+from downsample import minmax_indices, take, POINTS
+from instrument import stage
+from records import read_control, record_storage
+from rolling import moving_median, moving_mean
 
-args = sys.argv[1:]
+
+logger = logging.getLogger(__name__)
+
+FLAGS = ['--quiet', '--timings', '--force']
+VALUE_OPTIONS = ['--profile', '--output', '--format', '--jobs', '--points']
+
+argv = sys.argv[1:]
+
+
+def option_value(name, default=None):
+    return argv[argv.index(name) + 1] if name in argv[:-1] else default
+
+
+quiet = '--quiet' in argv # no per-row and per-series debug printing
+timings = '--timings' in argv
+profile = option_value('--profile')
+output = option_value('--output') # save the panels in this directory instead of showing them
+fmt = option_value('--format', 'png')
+jobs = int(option_value('--jobs', 1))
+points = int(option_value('--points', POINTS)) # per plotted series, 0 plots every day
+force = '--force' in argv # redraw panels even if their data did not change
+args = [x for i, x in enumerate(argv) if x not in FLAGS + VALUE_OPTIONS and (i == 0 or argv[i - 1] not in VALUE_OPTIONS)]
 
 
 def iso_to_date(iso):
@@ -15,152 +44,239 @@ def iso_to_date(iso):
     return datetime.date(int(y), int(m), int(d))
 
 
-def moving_median(v, window=5):
-    e = (window - 1) / 2
-    mm = []
-    for i in range(len(v)):
-        imin = int(i - e) if i - e > 0 else 0
-        imax = int(i + e + 1) if i + e < len(v) else len(v)
-        sample = sorted(v[imin:imax])
-        x = int(len(sample) / 2)
-        if len(sample) % 2 == 0:
-            mm.append((sample[x - 1] + sample[x]) / 2)
-        else:
-            mm.append(sample[x])
-    return mm
-
-
-def moving_mean(v, window=5):
-    e = (window - 1) / 2
-    mm = []
-    for i in range(len(v)):
-        imin = int(i - e) if i - e > 0 else 0
-        imax = int(i + e + 1) if i + e < len(v) else len(v)
-        sample = sorted(v[imin:imax])
-        mm.append(sum(sample) / len(sample))
-        # x = int(len(sample) / 2)
-        # if len(sample) % 2 == 0:
-        #     mm.append((sample[x - 1] + sample[x]) / 2)
-        # else:
-        #     mm.append(sample[x])
-    return mm
-
-
 def epley(w, r):
     return w * (1 + r/30)
     # return w * r/30
 
 
 
-def main():
-    dbfile = args[0] + '.database'
-    recfile = args[0] + '.record'
-    print('Reading:')
-    print(dbfile, recfile)
-
+DAY_DTYPE = np.dtype([('day', np.int64), ('top', np.float64), ('e1rm', np.float64), ('volume', np.float64)])
+
+
+# The record is read as a pipeline of generators, parse_rows -> split_bodyweight
+# -> reduce_sets, so that no stage holds on to the rows. What is kept is one
+# accumulator per training day and exercise, which is enough to work out the
+# daily top weight, estimated 1rm and volume once the bodyweight is known:
+# the partial bodyweight is the same for every set in a day, and both epley
+# and the volume grow with the weight for a fixed number of reps.
+
+
+def parse_rows(rows, quiet=False):
+    """Yield (date, exercise, sets, reps, weight, bodyweight), blanks as None"""
+    debug = not quiet and logger.isEnabledFor(logging.DEBUG)
+    for x in rows:
+        if debug:
+            logger.debug('%s', x)
+        yield (
+            x['date'],
+            x['exercise'] or None,
+            int(x['sets']) if x['sets'] else None,
+            int(x['reps']) if x['reps'] else None,
+            float(x['weight']) if x['weight'] else None,
+            float(x['bodyweight']) if x['bodyweight'] else None,
+        )
+
+
+def column_entries(cols, exercises):
+    """Yield the tuples of parse_rows straight from colstore columns, dates as datetime.date"""
+    names = [exercises[i] if i != colstore.MISSING_INT else None for i in cols['exercise'].tolist()]
+    ints = [[x if x != colstore.MISSING_INT else None for x in cols[name].tolist()] for name in ['sets', 'reps']]
+    floats = [[x if x == x else None for x in cols[name].tolist()] for name in ['weight', 'bodyweight']] # NaN != NaN
+    dates = cols['date'].astype('datetime64[D]').tolist()
+    return zip(dates, names, *ints, *floats)
+
+
+class DailyLog():
+    """Per-day state of the pipeline, dates in order of first appearance"""
+    def __init__(self):
+        self.day_index = {}
+        self.dates = []
+        self.bw = []
+        self.sessions = {} # (day, exercise) -> [top, weight volume, sets x reps, {reps: top}]
+
+    def day(self, date):
+        i = self.day_index.get(date)
+        if i is None:
+            i = self.day_index[date] = len(self.dates)
+            self.dates.append(date)
+            self.bw.append(np.nan)
+        return i
+
+
+def split_bodyweight(entries, log):
+    """Take the weigh-ins out of the stream, yield (day, exercise, sets, reps, weight)"""
+    for date, ex, sets, reps, weight, bodyweight in entries:
+        i = log.day(date)
+        if bodyweight is not None:
+            log.bw[i] = bodyweight
+        if ex:
+            yield i, ex, sets, reps, weight
+
+
+def reduce_sets(sets, log):
+    for i, ex, n, reps, weight in sets:
+        acc = log.sessions.get((i, ex))
+        if acc is None:
+            acc = log.sessions[(i, ex)] = [-np.inf, 0.0, 0, {}]
+        acc[0] = max(acc[0], weight)
+        acc[1] += weight*reps*n
+        acc[2] += reps*n
+        acc[3][reps] = max(acc[3].get(reps, -np.inf), weight)
+
+
+def fill_bodyweight(bw):
+    """Forward fill bodyweight, days before the first weigh-in get the first one"""
+    bw = np.array(bw)
+    known = np.flatnonzero(~np.isnan(bw))
+    if len(known) > 0:
+        last_known = np.maximum.accumulate(np.where(np.isnan(bw), known[0], np.arange(len(bw))))
+        bw = bw[last_known]
+    return bw
+
+
+def stream_record(ctrl, quiet=False):
+    """Run the record through the pipeline, return the DailyLog with its dates as datetime.date"""
+    log = DailyLog()
+    if record_storage(ctrl) == 'columnar':
+        # already typed, no need to go through strings
+        cols, exercises = colstore.load_record(ctrl)
+        reduce_sets(split_bodyweight(column_entries(cols, exercises), log), log)
+        return log
+    with open(ctrl['RECORD']['filename'], 'r') as rf:
+        reduce_sets(split_bodyweight(parse_rows(csv.DictReader(rf), quiet), log), log)
+    log.dates = [iso_to_date(x) for x in log.dates]
+    return log
+
+
+def daily_series(log, database, bw):
+    """Return a DAY_DTYPE array per exercise in database"""
+    daily = {x: [] for x in database.keys()}
+    for (i, ex), (top, volume, setreps, best) in sorted(log.sessions.items()):
+        # no bodyweight part at all for bwratio 0, also when no bodyweight was ever logged
+        partial_bw = bw[i]*database[ex] if database[ex] != 0 else 0.0
+        e1rm = np.max([
+            epley(w + partial_bw, r) - partial_bw if r > 1 else w
+            for r, w in best.items()
+        ])
+        daily[ex].append((i, top, e1rm, volume + partial_bw*setreps))
+    return {k: np.array(v, dtype=DAY_DTYPE) for k, v in daily.items()}
+
+
+def load_record(ctrl, database, quiet=False):
+    """Stream the record once
+
+    Returns (dates, daily, bw): the session dates in order of first
+    appearance, a DAY_DTYPE array per exercise where 'day' indexes into dates,
+    and the forward-filled bodyweight per date.
+    """
+    with stage('load'):
+        log = stream_record(ctrl, quiet)
+    with stage('aggregate'):
+        bw = fill_bodyweight(log.bw)
+        daily = daily_series(log, database, bw)
+    return log.dates, daily, bw
+
+
+def read_bwratios(dbfile):
+    """Return {exercise: bwratio} in database order"""
     database = {}
     with open(dbfile, 'r') as dbf:
         rdr = csv.DictReader(dbf)
         for x in rdr:
             database[x['exercise']] = float(x['bwratio'])
-    print('\nDatabase:')
-    print(database)
+    return database
 
-    dates = []
-    with open(recfile, 'r') as rbf:
-        rdr = csv.DictReader(rbf)
-        for x in rdr:
-            print(x)
-            if x['date'] in dates:
-                pass
-            else:
-                dates.append(x['date'])
-    print(dates)
-
-    record = {}
-    for x in database.keys():
-        record[x] = [[] for y in range(len(dates))]
-    bw = [None for x in range(len(dates))]
-    with open(recfile, 'r') as rbf:
-        rdr = csv.DictReader(rbf)
-        for x in rdr:
-            i = dates.index(x['date'])
-            print(i, x)
-            if x['bodyweight']:
-                bw[i] = float(x['bodyweight'])
-            ex = x['exercise']
-            if ex:
-                print(ex)
-                record[ex][i].append([int(x['sets']), int(x['reps']), float(x['weight'])])
-    print(record)
-
-    last_bw = bw[0]
-    for i in range(len(bw)):
-        if bw[i] == None:
-            bw[i] = last_bw
-        else:
-            last_bw = bw[i]
-    print(bw)
-
-    dates = [iso_to_date(x) for x in dates]
-
-    fig, ax = plt.subplots(nrows=2, ncols=2)
-    plt.tight_layout()
-
-    # Bodyweight plot
 
-    coming_days = [datetime.timedelta(days=x - 28) + dates[-1] for x in range(58)]
-    ax[0][0].plot(coming_days, [bw[-1] for __ in coming_days], linestyle=':', color='lightgray', alpha=0.6)
-    ax[0][0].plot(coming_days, [bw[-1] + (i - 28)/7 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
-    ax[0][0].plot(coming_days, [bw[-1] - (i - 28)/7 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
-    ax[0][0].plot(coming_days, [bw[-1] + (i - 28)/14 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
-    ax[0][0].plot(coming_days, [bw[-1] - (i - 28)/14 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
-    ax[0][0].plot(coming_days, [bw[-1] + (i - 28)/28 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
-    ax[0][0].plot(coming_days, [bw[-1] - (i - 28)/28 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
-
-    ax[0][0].plot(dates, bw, '.')
-    ax[0][0].plot(dates, moving_median(bw))
-    ax[0][0].plot(dates, moving_mean(bw, window=9))
-    ax[0][0].set_ylabel('bodyweight')
-    ax[0][0].grid(b=True, which='major', color='lightgray', linestyle='--')
-
-    # Lifted weight
-
-    for ex in database.keys():
-        xax = [x for x, y in zip(dates, record[ex]) if y]
-        yax = [max([z[2] for z in y]) + bw[dates.index(x)]*database[ex] for x, y in zip(dates, record[ex]) if y]
-        # yax = [max([y[2] for y in x]) for x in record[ex] if x]
-        print(xax)
-        print(yax)
-        ax[0][1].plot(xax, yax, '-o')
-        ax[0][1].set_ylabel('Weight + (partial) bodyweight')
-        ax[0][1].grid(b=True, which='major', color='lightgray', linestyle='--')
-
-    # Estimated 1rm
-
-    orm = epley
-    for ex in database.keys():
-        xax = [x for x, y in zip(dates, record[ex]) if y]
-        yax = [max([epley(z[2] + bw[dates.index(x)]*database[ex], z[1]) - bw[dates.index(x)]*database[ex] if z[1] > 1 else z[2] for z in y]) for x, y in zip(dates, record[ex]) if y]
-        print(xax)
-        print(yax)
-        ax[1][0].plot(xax, yax, '-o')
-        ax[1][0].set_ylabel('Estimated 1rm')
-        ax[1][0].legend()
-        ax[1][0].grid(b=True, which='major', color='lightgray', linestyle='--')
+def main():
+    instrument.setup(logging.WARNING if quiet else logging.DEBUG, timings, profile)
+    with stage('control'):
+        ctrl = read_control(args[0])
+    dbfile = ctrl['DATABASE']['filename']
+    recfile = ctrl['RECORD']['filename']
+    print('Reading:')
+    print(dbfile, recfile)
 
-    # Volume
+    database = read_bwratios(dbfile)
+    print('\nDatabase:')
+    print(database)
 
+    dates, daily, bw = load_record(ctrl, database, quiet)
+    logger.debug('%s', dates)
+    logger.debug('%s', daily)
+    logger.debug('%s', bw)
+
+    panels = [
+        ('bodyweight', draw_bodyweight, bodyweight_series(dates, bw, points)),
+        ('weight', draw_exercises, (exercise_series(database, dates, daily, 'top', points, bw), 'Weight + (partial) bodyweight')),
+        ('e1rm', draw_exercises, (exercise_series(database, dates, daily, 'e1rm', points), 'Estimated 1rm', True)),
+        ('volume', draw_exercises, (exercise_series(database, dates, daily, 'volume', points, bw), 'Total volume')),
+    ]
+
+    if output is not None:
+        with stage('render'):
+            written, unchanged = figures.write(output, panels, fmt, jobs, force)
+        print('\nWrote', written, 'panels to', output + ',', unchanged, 'unchanged.')
+    else:
+        with stage('render'):
+            import matplotlib.pyplot as plt
+            figures.show(plt, panels, 2, 2)
+            plt.tight_layout()
+        plt.show()
+    instrument.finish()
+
+
+def exercise_series(database, dates, daily, column, points, bw=None):
+    """[(exercise, dates, values)] of one daily column, with the lifted part of bodyweight added if bw is given
+
+    Each series is downsampled to about points points.
+    """
+    series = []
     for ex in database.keys():
-        xax = [x for x, y in zip(dates, record[ex]) if y]
-        yax = [sum([(z[2]+bw[dates.index(x)]*database[ex])*z[1]*z[0] for z in y]) + bw[dates.index(x)]*database[ex] for x, y in zip(dates, record[ex]) if y]
-        print(xax)
-        print(yax)
-        ax[1][1].plot(xax, yax, '-o')
-        ax[1][1].set_ylabel('Total volume')
-        ax[1][1].grid(b=True, which='major', color='lightgray', linestyle='--')
-
-    plt.show()
+        days = daily[ex]['day']
+        yax = daily[ex][column]
+        if bw is not None and database[ex] != 0:
+            yax = yax + bw[days]*database[ex]
+        idx = minmax_indices(yax, points)
+        xax = [dates[i] for i in days[idx]]
+        yax = yax[idx]
+        logger.debug('%s', xax)
+        logger.debug('%s', yax)
+        series.append((ex, xax, yax))
+    return series
+
+
+def bodyweight_series(dates, bw, points):
+    """(dates, bodyweight, moving median, moving mean), downsampled to about points points"""
+    median = np.asarray(moving_median(bw))
+    mean = np.asarray(moving_mean(bw, window=9))
+    idx = minmax_indices([bw, median, mean], points)
+    return take(dates, idx), bw[idx], median[idx], mean[idx]
+
+
+def draw_bodyweight(ax, dates, bw, median, mean):
+    coming_days = [datetime.timedelta(days=x - 28) + dates[-1] for x in range(58)]
+    ax.plot(coming_days, [bw[-1] for __ in coming_days], linestyle=':', color='lightgray', alpha=0.6)
+    ax.plot(coming_days, [bw[-1] + (i - 28)/7 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
+    ax.plot(coming_days, [bw[-1] - (i - 28)/7 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
+    ax.plot(coming_days, [bw[-1] + (i - 28)/14 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
+    ax.plot(coming_days, [bw[-1] - (i - 28)/14 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
+    ax.plot(coming_days, [bw[-1] + (i - 28)/28 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
+    ax.plot(coming_days, [bw[-1] - (i - 28)/28 for i, __ in enumerate(coming_days)], linestyle=':', color='lightgray', alpha=0.6)
+
+    ax.plot(dates, bw, '.')
+    ax.plot(dates, median)
+    ax.plot(dates, mean)
+    ax.set_ylabel('bodyweight')
+    ax.grid(True, which='major', color='lightgray', linestyle='--')
+
+
+def draw_exercises(ax, series, ylabel, legend=False):
+    for __, xax, yax in series:
+        ax.plot(xax, yax, '-o')
+    ax.set_ylabel(ylabel)
+    if legend:
+        ax.legend()
+    ax.grid(True, which='major', color='lightgray', linestyle='--')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+
+import configparser
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+
+from records import read_control, record_storage, database_stamp
+from analyze import stream_record, fill_bodyweight, daily_series, read_bwratios
+
+
+# Batch summaries over many athletes.
+#
+# Every control file matching the given patterns is summarized in a worker
+# process: the latest e1rm per exercise, the tonnage of the last week and the
+# bodyweight with its trend. The summaries go into one CSV table. The stamps
+# of each athlete's files are kept in a cache next to the table, and athletes
+# whose files did not change since the last run reuse their previous rows.
+
+BATCH_FIELDNAMES = [
+    'control', 'athlete', 'exercise', 'last_session', 'e1rm', 'tonnage_7d', 'bodyweight', 'bodyweight_trend'
+]
+TONNAGE_DAYS = 7
+TREND_DAYS = 28
+
+
+def cache_filename(outfile):
+    return outfile + '.cache'
+
+
+def athlete_files(ctrl, inf):
+    files = [inf, ctrl['RECORD']['filename'], ctrl['DATABASE']['filename']]
+    if record_storage(ctrl) == 'columnar':
+        files.append(os.path.join(ctrl['RECORD']['columns'], 'meta.json'))
+    return files
+
+
+def load_control(inf):
+    """read_control, with the record and database paths found from the control file's directory
+
+    setrack init writes them relative to the directory it ran in, which is
+    usually the one the control file is in, so a path is taken relative to
+    that directory where it exists there and as given otherwise.
+    """
+    ctrl = read_control(inf)
+    for section, key in [('RECORD', 'filename'), ('RECORD', 'columns'), ('DATABASE', 'filename')]:
+        if section not in ctrl or key not in ctrl[section]:
+            continue
+        beside = os.path.join(os.path.dirname(inf), ctrl[section][key])
+        if not os.path.isabs(ctrl[section][key]) and os.path.exists(beside):
+            ctrl[section][key] = beside
+    return ctrl
+
+
+def is_control(ctrl):
+    return 'RECORD' in ctrl and 'DATABASE' in ctrl
+
+
+def athlete_stamp(ctrl, inf):
+    """Size and modification time of every file behind a control file"""
+    return [[f] + database_stamp(f) for f in athlete_files(ctrl, inf)]
+
+
+def fmt(x):
+    return '' if np.isnan(x) else '{:.2f}'.format(x)
+
+
+def bodyweight_trend(days, bw):
+    """Latest weigh-in and its change per week over the last TREND_DAYS days"""
+    weighed = ~np.isnan(bw)
+    if not weighed.any():
+        return np.nan, np.nan
+    days = days[weighed]
+    bw = bw[weighed]
+    latest = np.argmax(days)
+    recent = days > days[latest] - TREND_DAYS
+    if len(np.unique(days[recent])) < 2:
+        return bw[latest], np.nan
+    slope = np.polyfit(days[recent], bw[recent], 1)[0]
+    return bw[latest], slope*7
+
+
+def summarize(inf):
+    """Return (summary rows, error) for one control file"""
+    try:
+        return summary_rows(inf), None
+    except (OSError, KeyError, ValueError, configparser.Error) as err:
+        return [], '{}: {}'.format(type(err).__name__, err)
+
+
+def summary_rows(inf):
+    ctrl = load_control(inf)
+    athlete = ctrl['USERINFO'].get('name', '')
+    database = read_bwratios(ctrl['DATABASE']['filename'])
+    log = stream_record(ctrl, quiet=True)
+    days = np.array(log.dates, dtype='datetime64[D]').astype(np.int64)
+    bodyweight, trend = bodyweight_trend(days, np.array(log.bw))
+    base = {
+        'control': inf,
+        'athlete': athlete,
+        'bodyweight': fmt(bodyweight),
+        'bodyweight_trend': fmt(trend),
+    }
+    daily = daily_series(log, database, fill_bodyweight(log.bw))
+
+    rows = []
+    for ex, series in daily.items():
+        if len(series) == 0:
+            continue
+        session_days = days[series['day']]
+        latest = np.argmax(session_days)
+        recent = session_days > days.max() - TONNAGE_DAYS
+        rows.append(dict(base,
+            exercise=ex,
+            last_session=str(np.datetime64(int(session_days[latest]), 'D')),
+            e1rm=fmt(series['e1rm'][latest]),
+            tonnage_7d=fmt(series['volume'][recent].sum()),
+        ))
+    if not rows:
+        rows.append(dict(base, exercise='', last_session='', e1rm='', tonnage_7d=''))
+    return rows
+
+
+def load_cache(outfile):
+    try:
+        with open(cache_filename(outfile), 'r') as cf:
+            return json.load(cf)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(outfile, cache):
+    tmp = cache_filename(outfile) + '.tmp'
+    with open(tmp, 'w') as cf:
+        json.dump(cache, cf)
+    os.replace(tmp, cache_filename(outfile))
+
+
+@click.command()
+@click.option('-o', '--output', type=click.Path(), default='batch.csv', help='Summary table to write.')
+@click.option('-j', '--jobs', type=int, default=os.cpu_count(), help='Worker processes.')
+@click.option('--force', is_flag=True, help='Summarize every athlete, even if unchanged.')
+@click.argument('patterns', type=str, nargs=-1, required=True)
+def main(output, jobs, force, patterns):
+    """Summarize every athlete whose control file matches one of PATTERNS"""
+    start = time.perf_counter()
+    controls = sorted(set(f for p in patterns for f in glob.glob(p) if os.path.isfile(f)))
+
+    cache = {} if force else load_cache(output)
+    stamps = {}
+    todo = []
+    n_ignored = 0
+    n_failed = 0
+    for inf in controls:
+        try:
+            ctrl = load_control(inf)
+        except (UnicodeDecodeError, configparser.Error):
+            ctrl = {}
+        if not is_control(ctrl):
+            # patterns like team/* also match the records, databases and their sidecars
+            n_ignored += 1
+            continue
+        try:
+            stamps[inf] = athlete_stamp(ctrl, inf)
+        except (OSError, KeyError) as err:
+            print(inf + ':', err, file=sys.stderr)
+            n_failed += 1
+            continue
+        if inf not in cache or cache[inf]['stamp'] != stamps[inf]:
+            todo.append(inf)
+
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(summarize, todo, chunksize=max(1, len(todo)//(jobs*4))))
+    else:
+        results = list(map(summarize, todo))
+
+    n_summarized = 0
+    for inf, (rows, error) in zip(todo, results):
+        if error is not None:
+            print(inf + ':', error, file=sys.stderr)
+            cache.pop(inf, None)
+            n_failed += 1
+        else:
+            cache[inf] = {'stamp': stamps[inf], 'rows': rows}
+            n_summarized += 1
+    cache = {inf: entry for inf, entry in cache.items() if inf in stamps}
+
+    with open(output, 'w', newline='') as of:
+        wtr = csv.DictWriter(of, fieldnames=BATCH_FIELDNAMES)
+        wtr.writeheader()
+        for inf in sorted(cache):
+            wtr.writerows(cache[inf]['rows'])
+    save_cache(output, cache)
+
+    elapsed = time.perf_counter() - start
+    print(len(controls) - n_ignored, 'athletes,', n_summarized, 'summarized,',
+        len(stamps) - len(todo), 'unchanged,', n_failed, 'failed,', n_ignored, 'other files ignored.')
+    print('{:.3f} s'.format(elapsed))
+
+
+if __name__ == '__main__':
+    main()
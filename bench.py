@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import click
+import numpy as np
+
+import analyze
+import colstore
+import ff
+import query
+import rngfit
+import rolling
+import setrack
+import synth
+from records import read_control
+
+
+# Benchmark suite.
+#
+# For each size (years of training history) one synthetic athlete is
+# generated with synth.py, and every benchmark is run on it. The best of
+# several repeats is reported and all timings are written to a JSON file
+# together with the commit they were measured at. Pass an earlier results
+# file to --compare to see the ratio between the two.
+
+def quiet(func, *args, **kwargs):
+    """Call func with its printing thrown away"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def ff_control(inf):
+    control = ff.Control()
+    control.inf = inf
+    control.ctrl = read_control(inf)
+    control.dbf = control.ctrl['DATABASE']['filename']
+    control.rf = control.ctrl['RECORD']['filename']
+    return control
+
+
+def benchmarks(base, years):
+    """Return [(name, function)] for one generated athlete, set up outside the timings"""
+    ctrl = read_control(base)
+    database = analyze.read_bwratios(ctrl['DATABASE']['filename'])
+    since = str(synth.START + datetime.timedelta(days=365*years - 8*7))
+    control = ff_control(base)
+    bw = analyze.fill_bodyweight(analyze.stream_record(ctrl, quiet=True).bw)
+    series = np.resize(bw, len(colstore.load_record(ctrl)[0]['date']))
+    db, state = rngfit.load_db(base + '.toml')
+    amraps = rngfit.load_amraps(base + '.toml', db, state)
+    amraps = [amraps[x] for x in db['exercises']]
+    plan_out = base + '.plan.out'
+
+    return [
+        ('load_record', lambda: colstore.load_record(ctrl)),
+        ('query_8_weeks', lambda: sum(1 for __ in query.query(ctrl, since))),
+        ('ff_aggregate', lambda: quiet(ff.load_aggregates, control, False)),
+        ('ff_aggregate_cached', lambda: quiet(ff.load_aggregates, control, True)),
+        ('analyze_load', lambda: analyze.load_record(ctrl, database, quiet=True)),
+        ('moving_median', lambda: rolling.moving_median(series, window=9)),
+        ('moving_mean', lambda: rolling.moving_mean(series, window=9)),
+        ('np_moving_median', lambda: rolling.np_moving_median(series, window=9)),
+        ('fit_latest', lambda: [rngfit.fit_exercise(a) for a in amraps]),
+        ('fit_sweep', lambda: [rngfit.sweep_exercise(a) for a in amraps]),
+        ('plan', lambda: quiet(rngfit.main, [
+            '--cache-size', '0', base, 'parse', '-i', base + '.plan', '-o', plan_out, '--seed', '0'
+        ], standalone_mode=False)),
+        # last, since it grows the record
+        ('rec_fe_x50', lambda: [quiet(setrack.main, [
+            base, 'rec', 'fe', '--year', '2020', '--month', '1', '--day', '6', 'ex000', '5,5,3x100'
+        ], standalone_mode=False) for __ in range(50)]),
+    ]
+
+
+def time_best(func, repeat):
+    func() # warm up imports and caches
+    times = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times)/len(times)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--sizes', type=str, default='1,4,16', help='Comma separated years of history to test.')
+@click.option('--repeat', type=int, default=3)
+@click.option('--seed', type=int, default=0)
+@click.option('-o', '--output', type=click.Path(), default='bench.json')
+@click.option('--compare', type=click.Path(exists=True), help='Earlier results to compare with.')
+def main(sizes, repeat, seed, output, compare):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in [int(x) for x in sizes.split(',')]:
+            base = synth.generate(tmp, 'y' + str(years), years=years, seed=seed)
+            n_rows = len(colstore.load_record(read_control(base))[0]['date'])
+            for name, func in benchmarks(base, years):
+                best, mean = time_best(func, repeat)
+                results.append({'size': years, 'rows': n_rows, 'benchmark': name, 'best': best, 'mean': mean})
+                print('{:>3} y {:>7} rows  {:<20} {:10.4f} s'.format(years, n_rows, name, best))
+
+    report = {
+        'commit': current_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+    with open(output, 'w') as of:
+        json.dump(report, of, indent=1)
+
+    if compare:
+        with open(compare, 'r') as cf:
+            old = json.load(cf)
+        before = {(r['size'], r['benchmark']): r['best'] for r in old['results']}
+        print('\nCompared with', old.get('commit'), '(new/old, below 1 is faster):')
+        for r in results:
+            key = (r['size'], r['benchmark'])
+            if key in before and before[key] > 0:
+                print('{:>3} y  {:<20} {:6.2f}'.format(r['size'], r['benchmark'], r['best']/before[key]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from rngfit import FitCache
+
+
+# Start-up time check for the quick commands.
+#
+# Runs each command under python -X importtime and fails if the summed import
+# time goes over the budget, if the whole run goes over the wall time budget
+# or if any of the heavy libraries were imported. The commands really log an
+# entry, to scratch files made by SETUP in a temporary directory, so that the
+# imports of the whole path are counted. A command must also have written to
+# the file next to it. The scratch rngfit database comes with a fit cache as
+# large as that of years of plottime sweeps, which the quick commands must
+# not have to read.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SETUP = [
+    ['setrack.py', 'x', 'init', '--username', 'x'],
+    ['setrack.py', 'x', 'db', 'entry', 'squat'],
+]
+RNGFIT_DB = 'exercises = [ "squat",]\n\n[squat]\namraps = "date,reps,weight\\n"\nrounding = 2.5\n'
+COMMANDS = [
+    (['setrack.py', 'x', 'rec', 'fe', 'squat', '3x5x100'], 'x.record'),
+    (['setrack.py', 'x', 'rec', 'entry', '-e', 'squat', '-r', '5', '-w', '100'], 'x.record'),
+    (['rngfit.py', 'x', 'entry', 'squat', '5x100'], 'x.toml.journal'),
+]
+HEAVY = ['numpy', 'scipy', 'matplotlib', 'toml']
+CACHED_FITS = 20 # sweeps of 8 years of days each
+CACHED_DAYS = 8*365
+
+
+def fill_fit_cache(dirname):
+    cache = FitCache(dirname)
+    for i in range(CACHED_FITS):
+        fits = [[100.0 + j/CACHED_DAYS, 29.0 + i, 1.234567, 0.345678] for j in range(CACHED_DAYS)]
+        cache.put(cache.key(str(i), {'fit': 'sweep'}), 'squat', fits)
+
+
+def import_times(args, written):
+    """Return ({module: self time in us}, total us, wall time in s, exit code, whether written grew) for a run"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # run from a scratch directory so that no real data files are touched
+        for setup in SETUP:
+            subprocess.run(
+                [sys.executable, os.path.join(HERE, setup[0])] + setup[1:],
+                cwd=tmp, stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL, check=True
+            )
+        with open(os.path.join(tmp, 'x.toml'), 'w') as tf:
+            tf.write(RNGFIT_DB)
+        fill_fit_cache(os.path.join(tmp, 'x.toml.fitcache'))
+        size = file_size(os.path.join(tmp, written))
+        start = time.perf_counter()
+        res = subprocess.run(
+            [sys.executable, '-X', 'importtime', os.path.join(HERE, args[0])] + args[1:],
+            cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        wall = time.perf_counter() - start
+        grew = file_size(os.path.join(tmp, written)) > size
+    times = {}
+    total = 0
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, __, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us)
+        total += int(self_us)
+    return times, total, wall, res.returncode, grew
+
+
+def file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+@click.command()
+@click.option('--budget', type=float, default=300.0, help='Import time budget per command in ms')
+@click.option('--wall-budget', type=float, default=500.0, help='Wall time budget per command in ms')
+def main(budget, wall_budget):
+    failed = False
+    for args, written in COMMANDS:
+        times, total, wall, returncode, grew = import_times(args, written)
+        heavy = sorted(m for m in times if m.split('.')[0] in HEAVY)
+        ok = returncode == 0 and grew and not heavy and total / 1000 <= budget and wall*1000 <= wall_budget
+        print('ok  ' if ok else 'FAIL', ' '.join(args), '%.1f ms imports, %.1f ms total' % (total / 1000, wall*1000))
+        if returncode != 0:
+            print('    exited with', returncode)
+        if not grew:
+            print('    wrote nothing to', written)
+        if heavy:
+            print('    imported', ', '.join(m for m in heavy if '.' not in m))
+        failed = failed or not ok
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
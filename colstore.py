@@ -0,0 +1,221 @@
+import csv
+import datetime
+import io
+import json
+import os
+
+import numpy as np
+
+from records import RECORD_FIELDNAMES, exercise_names, locked, read_cut, finish_cut, cut_record
+from records import record_storage
+
+
+# Columnar record storage.
+#
+# The record is kept as one .npy file per field in a directory, which can be
+# memory mapped on load. Dates are stored as days since 1970-01-01 (so the
+# date column can be viewed as datetime64[D]), exercises as their row number
+# in the database. Missing integers are -1, missing floats are NaN.
+#
+# New rows are appended to the ordinary CSV record file, which acts as an
+# append log. compact() moves the log into the column files. meta.json holds
+# the number of valid rows in the columns and the byte offset in the log up
+# to which rows have already been compacted, together with the generation of
+# the last cut of the log that offset accounts for. A later cut means the log
+# was truncated after compaction but meta was not updated yet.
+
+COLUMNS = {
+    'date': np.int32,
+    'exercise': np.int32,
+    'sets': np.int32,
+    'reps': np.int32,
+    'weight': np.float64,
+    'rpe': np.float64,
+    'bodyweight': np.float64,
+}
+MISSING_INT = -1
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def column_filename(coldir, name):
+    return os.path.join(coldir, name + '.npy')
+
+
+def meta_filename(coldir):
+    return os.path.join(coldir, 'meta.json')
+
+
+def read_meta(coldir):
+    with open(meta_filename(coldir), 'r') as mf:
+        return json.load(mf)
+
+
+def write_meta(coldir, meta):
+    tmp = meta_filename(coldir) + '.tmp'
+    with open(tmp, 'w') as mf:
+        json.dump(meta, mf)
+        mf.flush()
+        os.fsync(mf.fileno())
+    os.replace(tmp, meta_filename(coldir))
+
+
+def save_column(coldir, name, values):
+    tmp = column_filename(coldir, name) + '.tmp'
+    with open(tmp, 'wb') as cf:
+        np.save(cf, values)
+        cf.flush()
+        os.fsync(cf.fileno())
+    os.replace(tmp, column_filename(coldir, name))
+
+
+def header_offset(logfile):
+    with open(logfile, 'rb') as lf:
+        lf.readline()
+        return lf.tell()
+
+
+def create(coldir, logfile):
+    """Create an empty column store on top of an existing CSV record"""
+    os.makedirs(coldir, exist_ok=True)
+    for name, dtype in COLUMNS.items():
+        save_column(coldir, name, np.zeros(0, dtype=dtype))
+    cut = read_cut(logfile)
+    write_meta(coldir, {
+        'rows': 0,
+        'log_offset': header_offset(logfile),
+        'generation': cut['generation'] if cut is not None else 0,
+    })
+
+
+def to_day(iso):
+    y, m, d = iso.split('-')
+    return (datetime.date(int(y), int(m), int(d)) - EPOCH).days
+
+
+def rows_to_columns(rows, exercise_ids):
+    cols = {name: [] for name in COLUMNS}
+    for row in rows:
+        cols['date'].append(to_day(row['date']))
+        if row['exercise']:
+            if row['exercise'] not in exercise_ids:
+                raise ValueError('Exercise: ' + row['exercise'] + ' not in database.')
+            cols['exercise'].append(exercise_ids[row['exercise']])
+        else:
+            cols['exercise'].append(MISSING_INT)
+        for name in ['sets', 'reps']:
+            cols[name].append(int(row[name]) if row[name] else MISSING_INT)
+        for name in ['weight', 'rpe', 'bodyweight']:
+            cols[name].append(float(row[name]) if row[name] else np.nan)
+    return {name: np.array(v, dtype=COLUMNS[name]) for name, v in cols.items()}
+
+
+def log_offset(logfile, meta):
+    """Where the rows not yet in the columns start in the log"""
+    cut = read_cut(logfile)
+    if cut is not None and cut['generation'] > meta.get('generation', 0):
+        if cut['done']:
+            return cut['length']
+        # interrupted while cutting, nothing was appended since
+        return min(meta['log_offset'], os.path.getsize(logfile))
+    if os.path.getsize(logfile) < meta['log_offset']:
+        # cut by a version that kept no generations, before meta was updated
+        return header_offset(logfile)
+    return meta['log_offset']
+
+
+def read_log(logfile, meta, exercise_ids):
+    """Parse the complete log lines not yet compacted, return (columns, end offset)"""
+    offset = log_offset(logfile, meta)
+    with open(logfile, 'rb') as lf:
+        lf.seek(offset)
+        tail = lf.read()
+    tail = tail[:tail.rfind(b'\n') + 1]
+    rdr = csv.DictReader(io.StringIO(tail.decode()), fieldnames=RECORD_FIELDNAMES)
+    return rows_to_columns(rdr, exercise_ids), offset + len(tail)
+
+
+def load(coldir, logfile, dbfile, mmap=True):
+    """Return (columns, exercise names) with compacted rows and the log merged
+
+    With nothing in the log the columns are read-only memory maps of the files.
+    """
+    meta = read_meta(coldir)
+    exercises = exercise_names(dbfile)
+    exercise_ids = {x: i for i, x in enumerate(exercises)}
+    cols = {
+        name: np.load(column_filename(coldir, name), mmap_mode='r' if mmap else None)[:meta['rows']]
+        for name in COLUMNS
+    }
+    logcols, __ = read_log(logfile, meta, exercise_ids)
+    if len(logcols['date']) > 0:
+        cols = {name: np.concatenate([cols[name], logcols[name]]) for name in COLUMNS}
+    return cols, exercises
+
+
+def load_record(ctrl):
+    """Return (columns, exercise names) for the record of ctrl, whatever the storage backend
+
+    A CSV record is parsed into the same typed columns.
+    """
+    if record_storage(ctrl) == 'columnar':
+        return load(ctrl['RECORD']['columns'], ctrl['RECORD']['filename'], ctrl['DATABASE']['filename'])
+    exercises = exercise_names(ctrl['DATABASE']['filename'])
+    with open(ctrl['RECORD']['filename'], 'r') as rf:
+        cols = rows_to_columns(csv.DictReader(rf), {x: i for i, x in enumerate(exercises)})
+    return cols, exercises
+
+
+def compact(coldir, logfile, dbfile):
+    """Merge the append log into the column files, return the number of rows moved"""
+    # hold the record lock so that no rows are appended while the log is cut
+    with open(logfile, 'a+b') as lf, locked(lf):
+        return compact_locked(coldir, logfile, dbfile, lf.fileno())
+
+
+def compact_locked(coldir, logfile, dbfile, fd):
+    meta = read_meta(coldir)
+    finish_cut(logfile, fd)
+    exercise_ids = {x: i for i, x in enumerate(exercise_names(dbfile))}
+    logcols, end = read_log(logfile, meta, exercise_ids)
+    generation = meta.get('generation', 0)
+    cut = read_cut(logfile)
+    if cut is not None and cut['generation'] > generation:
+        generation = cut['generation'] # meta catches up with a cut below
+    n_new = len(logcols['date'])
+    if n_new == 0:
+        if generation != meta.get('generation', 0):
+            write_meta(coldir, {'rows': meta['rows'], 'log_offset': end, 'generation': generation})
+        return 0
+
+    # columns may be longer than meta['rows'] after an interrupted compaction,
+    # so always cut them to the committed length before appending
+    for name in COLUMNS:
+        old = np.load(column_filename(coldir, name), mmap_mode='r')[:meta['rows']]
+        save_column(coldir, name, np.concatenate([old, logcols[name]]))
+    write_meta(coldir, {'rows': meta['rows'] + n_new, 'log_offset': end, 'generation': generation})
+
+    # Everything up to end is now in the columns, drop it from the log
+    if os.path.getsize(logfile) == end:
+        head = header_offset(logfile)
+        cut_record(logfile, fd, head, generation + 1)
+        write_meta(coldir, {'rows': meta['rows'] + n_new, 'log_offset': head, 'generation': generation + 1})
+    return n_new
+
+
+def iter_rows(cols, exercises):
+    """Yield rows as the csv module would read them from a CSV record
+
+    Only for writing rows out as CSV or JSON, everything else should use the
+    columns as they are.
+    """
+    for i in range(len(cols['date'])):
+        row = {'date': str(EPOCH + datetime.timedelta(days=int(cols['date'][i])))}
+        ex = int(cols['exercise'][i])
+        row['exercise'] = exercises[ex] if ex != MISSING_INT else ''
+        for name in ['sets', 'reps']:
+            v = int(cols[name][i])
+            row[name] = str(v) if v != MISSING_INT else ''
+        for name in ['weight', 'rpe', 'bodyweight']:
+            v = float(cols[name][i])
+            row[name] = str(v) if not np.isnan(v) else ''
+        yield row
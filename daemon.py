@@ -0,0 +1,186 @@
+import json
+import os
+import signal
+import socket
+
+from records import RECORD_FIELDNAMES, read_control, append_record
+from records import load_index, database_stamp
+from query import query
+
+
+# Local ingest daemon.
+#
+# setrack.py INF serve keeps the control file, the exercise index and an open
+# record handle in memory and listens on a Unix socket next to the control
+# file. Messages are single lines of JSON, each answered by a single line of
+# JSON with 'ok' set and either the result or an 'error'.
+#
+#   {'op': 'ping'}
+#   {'op': 'resolve', 'exercise': NAME}     -> {'exercise': canonical name or None}
+#   {'op': 'append', 'rows': [ROW, ...]}    -> {'rows': number written}
+#   {'op': 'query', 'since': DATE, 'until': DATE, 'exercise': NAME}
+#                                           -> {'rows': [ROW, ...]}, filters optional
+#
+# Appends from all connections are queued and written by a single task, which
+# takes everything queued so far and commits it as one locked write. A client gets
+# its reply once its rows are flushed to the record file.
+
+
+def socket_filename(inf):
+    return inf + '.sock'
+
+
+##############
+### CLIENT ###
+##############
+
+
+def request(sockpath, message):
+    """Send one message to the daemon, return the reply or None if no daemon is listening"""
+    if not os.path.exists(sockpath):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(sockpath)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return None # stale socket file from a daemon that died
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        reply = sock.makefile('rb').readline()
+    if not reply:
+        return {'ok': False, 'error': 'No reply from daemon.'}
+    return json.loads(reply)
+
+
+def is_running(sockpath):
+    return request(sockpath, {'op': 'ping'}) is not None
+
+
+##############
+### SERVER ###
+##############
+
+
+class Server():
+    def __init__(self, inf):
+        self.ctrl = read_control(inf)
+        self.dbf = self.ctrl['DATABASE']['filename']
+        self.rf = open(self.ctrl['RECORD']['filename'], 'a+b')
+        self.index = load_index(self.dbf)
+        self.stamp = database_stamp(self.dbf)
+        self.loop = None
+        self.queue = None
+        self.n_commits = 0
+        self.n_rows = 0
+
+    def resolve(self, exercise):
+        # db entry may run while we are serving, so follow database changes
+        stamp = database_stamp(self.dbf)
+        if stamp != self.stamp:
+            self.index = load_index(self.dbf)
+            self.stamp = stamp
+        return self.index.get(exercise)
+
+    async def commit_loop(self):
+        """Write all queued appends in one go, then answer their clients"""
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                append_record(self.rf, [row for rows, __ in batch for row in rows])
+            except OSError as err:
+                for __, done in batch:
+                    done.set_exception(err)
+                continue
+            self.n_commits += 1
+            for rows, done in batch:
+                self.n_rows += len(rows)
+                done.set_result(len(rows))
+
+    async def append(self, rows):
+        for row in rows:
+            if row.get('exercise'):
+                exercise = self.resolve(row['exercise'])
+                if exercise is None:
+                    raise ValueError('Exercise: ' + row['exercise'] + ' not in database.')
+                row['exercise'] = exercise
+        rows = [{name: row.get(name) for name in RECORD_FIELDNAMES} for row in rows]
+        done = self.loop.create_future()
+        await self.queue.put((rows, done))
+        return await done
+
+    def query(self, since=None, until=None, exercise=None):
+        if exercise is not None:
+            exercise = self.resolve(exercise)
+            if exercise is None:
+                return []
+        return list(query(self.ctrl, since, until, exercise))
+
+    async def handle(self, message):
+        op = message.get('op')
+        if op == 'ping':
+            return {'ok': True, 'commits': self.n_commits, 'rows': self.n_rows}
+        if op == 'resolve':
+            return {'ok': True, 'exercise': self.resolve(message['exercise'])}
+        if op == 'append':
+            return {'ok': True, 'rows': await self.append(message['rows'])}
+        if op == 'query':
+            return {'ok': True, 'rows': self.query(
+                message.get('since'), message.get('until'), message.get('exercise')
+            )}
+        raise ValueError('Unknown operation: ' + str(op))
+
+    async def client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self.handle(json.loads(line))
+                except (ValueError, KeyError, TypeError, OSError) as err:
+                    reply = {'ok': False, 'error': str(err)}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def serve(inf, sockpath):
+    """Run the daemon until interrupted"""
+    # asyncio is only needed here, keep it out of the client start-up
+    import asyncio
+
+    if is_running(sockpath):
+        print('A daemon is already listening on', sockpath + '.')
+        return 0
+    if os.path.exists(sockpath):
+        os.unlink(sockpath)
+
+    server = Server(inf)
+
+    async def run():
+        server.loop = asyncio.get_running_loop()
+        server.queue = asyncio.Queue()
+        committer = asyncio.ensure_future(server.commit_loop())
+        listener = await asyncio.start_unix_server(server.client, path=sockpath)
+        stop = asyncio.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            server.loop.add_signal_handler(sig, stop.set)
+        print('Listening on', sockpath, flush=True)
+        await stop.wait()
+        # stop accepting, but commit what is already queued
+        listener.close()
+        while not server.queue.empty():
+            await asyncio.sleep(0)
+        committer.cancel()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.rf.close()
+        if os.path.exists(sockpath):
+            os.unlink(sockpath)
+    print('Committed', server.n_rows, 'rows in', server.n_commits, 'writes.')
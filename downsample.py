@@ -0,0 +1,62 @@
+from lazy import LazyModule
+
+# rngfit imports this, numpy is only loaded once a series is downsampled
+np = LazyModule('numpy')
+
+
+# Downsampling of long series before plotting.
+#
+# A plot is only so many pixels wide, and a multi-year history drawn point by
+# point mostly lands on the same pixels again and again. minmax_indices()
+# splits the points into equal buckets and keeps, for every series, the
+# lowest and the highest point of each bucket, together with the first and
+# last point. The shape of the line is kept, and every extreme, such as a PR,
+# is kept at its exact date and value. Largest-triangle-three-buckets would
+# look a little smoother, but can drop a maximum.
+#
+# The series are only touched when they are longer than the number of points
+# asked for, and 0 turns downsampling off.
+
+POINTS = 1000
+
+
+def minmax_indices(ys, points=POINTS):
+    """Sorted indices that keep the per bucket minimum and maximum of every series in ys
+
+    ys is one series or a sequence of equally long series sharing their x.
+    The buckets are the same for all series, and are made larger until at
+    most points indices are left or there is a single bucket. NaN is never
+    picked over a number.
+    """
+    ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+    k, n = ys.shape
+    if points <= 0 or n <= points:
+        return np.arange(n)
+
+    highs = np.where(np.isnan(ys), -np.inf, ys)
+    lows = np.where(np.isnan(ys), np.inf, ys)
+    n_buckets = max(1, (points - 2)//2)
+    while True:
+        idx = bucket_extremes(highs, lows, n_buckets)
+        if len(idx) <= points or n_buckets == 1:
+            return idx
+        n_buckets = max(1, min(n_buckets - 1, n_buckets*points//len(idx)))
+
+
+def bucket_extremes(highs, lows, n_buckets):
+    k, n = highs.shape
+    size = -(-n//n_buckets)
+    n_buckets = -(-n//size)
+    offsets = np.arange(n_buckets)*size
+    pad = ((0, 0), (0, n_buckets*size - n))
+    hi = np.pad(highs, pad, constant_values=-np.inf).reshape(k, n_buckets, size).argmax(axis=2) + offsets
+    lo = np.pad(lows, pad, constant_values=np.inf).reshape(k, n_buckets, size).argmin(axis=2) + offsets
+    idx = np.unique(np.concatenate([hi.ravel(), lo.ravel(), [0, n - 1]]))
+    return idx[idx < n]
+
+
+def take(x, idx):
+    """x at the indices idx, for both lists and arrays"""
+    if isinstance(x, np.ndarray):
+        return x[idx]
+    return [x[i] for i in idx]
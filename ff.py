@@ -1,15 +1,25 @@
 #!/usr/bin/python3
 
 import csv
-import configparser
 import click
-import datetime
-import re as re
-import matplotlib.pyplot as plt
+import json
+import logging
+import os
+import zlib
+
+import instrument
+from instrument import stage
+from lazy import LazyModule
+from records import read_control, record_storage
+
+# numpy and the column store are only loaded once a record is aggregated
+np = LazyModule('numpy')
+colstore = LazyModule('colstore')
 
 
 VERSION = '0.0.1'
 BPRF = -9999.0
+logger = logging.getLogger(__name__)
 
 
 class Control():
@@ -18,6 +28,8 @@ class Control():
 		self.inf = None
 		self.dbf = None
 		self.rf = None
+		self.ctrl = None
+		self.cols = None
 
 
 pass_control = click.make_pass_decorator(Control, ensure=True)
@@ -33,80 +45,234 @@ def iepley(I):
 @click.group()
 @click.version_option(version=VERSION)
 @click.option('--verbose', is_flag=True, help='Increase output verbosity (maybe).')
+@click.option('--timings', is_flag=True, help='Report wall time and calls per stage on exit.')
+@click.option('--profile', type=click.Path(), help='Write cProfile stats to this file.')
 @click.argument('inf', type=click.Path())
 @pass_control
-def main(control, verbose, inf):
+def main(control, verbose, timings, profile, inf):
 	control.verbose = verbose
 	control.inf = inf
-	ctrl = configparser.ConfigParser()
-	ctrl.read(control.inf)
+	instrument.setup(logging.DEBUG if verbose else logging.INFO, timings, profile)
+	click.get_current_context().call_on_close(instrument.finish)
+	with stage('control'):
+		ctrl = read_control(control.inf)
+	control.ctrl = ctrl
 	control.dbf = ctrl['DATABASE']['filename']
 	control.rf = ctrl['RECORD']['filename']
+	control.cols = ctrl['RECORD'].get('columns')
+
+
+def cache_filename(rf):
+    return rf + '.ffcache'
+
+
+def new_aggregates():
+    return {
+        'exercise': [],
+        'bwratio': [],
+        'first_day': None, # day number of row 0 in performance/work
+        'performance': np.zeros((0, 0)), # best e1RM, indexed by (day - first_day, exercise id)
+        'work': np.zeros((0, 0)), # tonnage, same indexing
+        'currentbw': 100, # initial guess as it might not be given in the first record
+        'fieldnames': None,
+        'offset': 0, # byte offset in the record just past the last processed row
+        'checksum': 0, # crc32 of the record up to offset
+    }
+
+
+def sync_database(agg, dbf):
+    """Add new database exercises to agg, return False if known ones changed"""
+    drdr = csv.DictReader(dbf) # hurr durr durr
+    n_known = len(agg['exercise'])
+    for i, row in enumerate(drdr):
+        if i < n_known:
+            if agg['exercise'][i] != row['exercise'] or agg['bwratio'][i] != float(row['bwratio']):
+                return False
+            continue
+        agg['exercise'].append(row['exercise'])
+        agg['bwratio'].append(float(row['bwratio']))
+    n_new = len(agg['exercise']) - n_known
+    ndays = agg['work'].shape[0]
+    agg['performance'] = np.hstack([agg['performance'], np.full((ndays, n_new), BPRF)])
+    agg['work'] = np.hstack([agg['work'], np.zeros((ndays, n_new))])
+    return True
+
+
+def load_cache(rf):
+    """Return the cached aggregates if the record has only been appended to since"""
+    try:
+        with np.load(cache_filename(rf)) as cf:
+            agg = json.loads(str(cf['meta']))
+            agg['performance'] = cf['performance']
+            agg['work'] = cf['work']
+        checksum = 0
+        with open(rf, 'rb') as rbf:
+            remaining = agg['offset']
+            while remaining > 0:
+                chunk = rbf.read(min(remaining, 1 << 20))
+                if not chunk:
+                    return None # record got shorter
+                checksum = zlib.crc32(chunk, checksum)
+                remaining -= len(chunk)
+    except (OSError, ValueError, KeyError):
+        return None
+    if checksum != agg['checksum']:
+        return None # record was edited, not just appended to
+    return agg
+
+
+def save_cache(rf, agg):
+    meta = {k: v for k, v in agg.items() if k not in ['performance', 'work']}
+    tmp = cache_filename(rf) + '.tmp'
+    with open(tmp, 'wb') as cf:
+        np.savez(cf, meta=np.array(json.dumps(meta)), performance=agg['performance'], work=agg['work'])
+    os.replace(tmp, cache_filename(rf))
+
+
+def new_rows(agg, rf):
+    """Yield the rows appended past agg['offset'], keeping the offsets up to date"""
+    with open(rf, 'rb') as rbf:
+        rbf.seek(agg['offset'])
+        for line in rbf:
+            if not line.endswith(b'\n'):
+                break # incomplete row that is still being written
+            fields = next(csv.reader([line.decode()]))
+            agg['offset'] += len(line)
+            agg['checksum'] = zlib.crc32(line, agg['checksum'])
+            if agg['fieldnames'] is None:
+                agg['fieldnames'] = fields
+                continue
+            yield dict(zip(agg['fieldnames'], fields))
+
+
+def aggregate(cols, bwratio, initial_bw=100.0):
+    """Scatter record columns into (day, exercise) matrices of best e1RM and tonnage
+
+    Returns (first_day, performance, work, last_bw), untrained days hold BPRF and 0.0.
+    """
+    n_rows = len(cols['date'])
+    if n_rows == 0:
+        return None, None, None, initial_bw
+
+    # forward fill bodyweight in record order
+    bw = cols['bodyweight']
+    last_known = np.maximum.accumulate(np.where(np.isnan(bw), -1, np.arange(n_rows)))
+    bw = np.where(last_known >= 0, bw[np.maximum(last_known, 0)], initial_bw)
+
+    first_day = int(cols['date'].min())
+    day = cols['date'] - first_day
+    performance = np.full((int(day.max()) + 1, len(bwratio)), BPRF)
+    work = np.zeros(performance.shape)
+
+    trained = cols['exercise'] != colstore.MISSING_INT
+    day = day[trained]
+    exc = cols['exercise'][trained]
+    reps = cols['reps'][trained]
+    partial_bw = np.asarray(bwratio)[exc]*bw[trained]
+    load = cols['weight'][trained] + partial_bw
+
+    # go with tonnage for now
+    np.add.at(work, (day, exc), cols['sets'][trained]*reps*load)
+
+    # estimate 1rm assuming 100% effort
+    np.maximum.at(performance, (day, exc), epley(load, reps) - partial_bw)
+
+    return first_day, performance, work, float(bw[-1])
+
+
+def merge(agg, first_day, performance, work):
+    """Fold matrices from aggregate() into agg, growing the day range as needed"""
+    if first_day is None:
+        return
+    if agg['first_day'] is None:
+        agg['first_day'], agg['performance'], agg['work'] = first_day, performance, work
+        return
+    start = min(agg['first_day'], first_day)
+    end = max(agg['first_day'] + agg['work'].shape[0], first_day + work.shape[0])
+    merged_performance = np.full((end - start, work.shape[1]), BPRF)
+    merged_work = np.zeros(merged_performance.shape)
+    old = slice(agg['first_day'] - start, agg['first_day'] - start + agg['work'].shape[0])
+    merged_performance[old] = agg['performance']
+    merged_work[old] = agg['work']
+    new = slice(first_day - start, first_day - start + work.shape[0])
+    merged_performance[new] = np.maximum(merged_performance[new], performance)
+    merged_work[new] += work
+    agg['first_day'], agg['performance'], agg['work'] = start, merged_performance, merged_work
+
+
+def load_aggregates(control, use_cache=True):
+    """Return the up to date aggregates for the record of control"""
+    # The columnar backend is cheap to load in full, the cache is for csv records
+    csv_record = record_storage(control.ctrl) == 'csv'
+
+    agg = None
+    if csv_record and use_cache:
+        with stage('cache'):
+            agg = load_cache(control.rf)
+    with open(control.dbf, 'r') as dbf:
+        if agg is None or not sync_database(agg, dbf):
+            if agg is not None:
+                print('Database bwratios changed, rebuilding aggregates.')
+            agg = new_aggregates()
+            dbf.seek(0)
+            sync_database(agg, dbf)
+    logger.debug('%s %s', agg['exercise'], agg['bwratio'])
+
+    with stage('load'):
+        if csv_record:
+            exercise_ids = {x: i for i, x in enumerate(agg['exercise'])}
+            cols = colstore.rows_to_columns(new_rows(agg, control.rf), exercise_ids)
+        else:
+            cols, __ = colstore.load(control.cols, control.rf, control.dbf)
+
+    with stage('aggregate'):
+        first_day, performance, work, agg['currentbw'] = aggregate(cols, agg['bwratio'], agg['currentbw'])
+        merge(agg, first_day, performance, work)
+
+    if csv_record:
+        with stage('cache'):
+            save_cache(control.rf, agg)
+    return agg
+
+
+def aggregate_dates(agg):
+    if agg['first_day'] is None: # nothing recorded yet
+        return np.array([], dtype='datetime64[D]')
+    return np.datetime64('1970-01-01') + agg['first_day'] + np.arange(agg['work'].shape[0])
 
 
 @main.command()
+@click.option('--no-cache', is_flag=True, help='Ignore and rebuild the aggregate cache.')
 @pass_control
-def plot(control):
+def plot(control, no_cache):
     print(control.inf, control.dbf, control.rf)
 
-    exercise = []
-    bwratio = []
-    performance = []
-    work = []
-
     # define the one rep max formula and its inverse
     rmf = epley
     irmf = iepley
 
-    with open(control.dbf, 'r') as dbf, open(control.rf, 'r') as rf:
-        drdr = csv.DictReader(dbf) # hurr durr durr
-        for row in drdr:
-            exercise.append(row['exercise'])
-            bwratio.append(float(row['bwratio']))
-            performance.append([BPRF])
-            work.append([0.0])
-        if control.verbose:
-            print(exercise, bwratio)
-
-        rrdr = csv.DictReader(rf)
-        currentbw = 100 # initial guess as it might not be given in the first record
-        currentdate = None
-        for row in rrdr:
-            print(row)
-
-            # update date such that any new input can be read into the last point of performance/work
-            previousdate = currentdate
-            datenums = [int(x) for x in re.match(r'(\d+)-(\d+)-(\d+)', row['date']).groups()]
-            print(datenums)
-            currentdate = datetime.date(datenums[0], datenums[1], datenums[2])
-            print(currentdate)
-            dayspassed = (currentdate - previousdate).days if previousdate is not None else 0
-            print(dayspassed)
-            if dayspassed > 0:
-                for x in performance:
-                    x.append(BPRF)
-                for x in work:
-                    x.append(0.0)
-
-            # update bodyweight
-            if row['bodyweight']:
-                currentbw = float(row['bodyweight'])
-
-            if row['exercise']:
-                exc = exercise.index(row['exercise'])
-                reps = int(row['reps'])
-                sets = int(row['sets'])
-                weight = float(row['weight'])
-                print(exc, sets, reps, weight)
-
-                # go with tonnage for now
-                work[exc][-1] += sets*reps*(weight + bwratio[exc]*currentbw)
-
-                # estimate 1rm assuming 100% effort
-                performance[exc][-1] = max(performance[exc][-1], epley(weight + bwratio[exc]*currentbw, reps) - bwratio[exc]*currentbw)
-
+    agg = load_aggregates(control, not no_cache)
+    performance = agg['performance']
+    work = agg['work']
     print(performance, work)
 
 
+@main.command()
+@click.option('--no-cache', is_flag=True, help='Ignore and rebuild the aggregate cache.')
+@click.argument('outfile', type=click.Path())
+@pass_control
+def export(control, no_cache, outfile):
+    """Write the per-day performance and work matrices to an .npz file"""
+    agg = load_aggregates(control, not no_cache)
+    with open(outfile, 'wb') as of:
+        np.savez(
+            of,
+            dates=aggregate_dates(agg),
+            exercise=np.array(agg['exercise']),
+            performance=agg['performance'],
+            work=agg['work']
+        )
+
+
 if __name__ == '__main__':
     main()
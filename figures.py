@@ -0,0 +1,134 @@
+import hashlib
+import json
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Figure output for the plotting commands.
+#
+# A figure is a (name, draw, args) triple, where draw(ax, *args) draws it on
+# one set of axes. show() puts all of them in one window as a grid of
+# subplots, like the commands always did. write() instead saves each as its
+# own file in an output directory with the non-interactive Agg backend, so it
+# runs without a display.
+#
+# Each written figure is fingerprinted by its draw function and the data in
+# args, and the fingerprints are kept in a manifest in the directory. A
+# figure whose fingerprint and file are unchanged is not drawn again, so after
+# new data for one exercise only that exercise's figure is redone.
+
+FORMATS = ['png', 'svg']
+
+
+def manifest_filename(outdir):
+    return os.path.join(outdir, '.figures.json')
+
+
+def figure_filename(name, fmt):
+    return re.sub(r'[^\w.-]', '_', name) + '.' + fmt
+
+
+def feed(h, x):
+    """Hash the values in x, so that equal data gives equal hashes whatever container or float type holds it"""
+    if isinstance(x, dict):
+        h.update(b'{')
+        for k in sorted(x):
+            feed(h, k)
+            feed(h, x[k])
+        h.update(b'}')
+    elif isinstance(x, (list, tuple)):
+        h.update(b'[')
+        for v in x:
+            feed(h, v)
+        h.update(b']')
+    elif hasattr(x, 'dtype') and getattr(x, 'ndim', 0) > 0:
+        h.update(b'(' + str(x.shape).encode())
+        for name in x.dtype.names or [None]:
+            v = x if name is None else x[name]
+            if v.dtype.kind == 'O':
+                feed(h, v.tolist())
+                continue
+            if v.dtype.kind in 'fiub':
+                v = v.astype('float64')
+            h.update(str(v.dtype).encode() + v.tobytes())
+        h.update(b')')
+    elif isinstance(x, float) or hasattr(x, 'dtype') and x.dtype.kind in 'fiub':
+        h.update(repr(float(x)).encode())
+    else:
+        h.update(repr(x).encode())
+    h.update(b',')
+
+
+def fingerprint(draw, args):
+    h = hashlib.sha1((draw.__module__ + '.' + draw.__qualname__).encode())
+    feed(h, args)
+    return h.hexdigest()
+
+
+def load_manifest(outdir):
+    try:
+        with open(manifest_filename(outdir), 'r') as mf:
+            return json.load(mf)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(outdir, manifest):
+    tmp = manifest_filename(outdir) + '.tmp'
+    with open(tmp, 'w') as mf:
+        json.dump(manifest, mf, indent=1)
+    os.replace(tmp, manifest_filename(outdir))
+
+
+def draw_figure(draw, args, filename):
+    """Draw one figure with the Agg backend and save it to filename"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    fig, ax = plt.subplots()
+    draw(ax, *args)
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def write(outdir, figures, fmt='png', jobs=1, force=False):
+    """Save figures that changed since the last write to outdir, return (written, unchanged)
+
+    With jobs > 1 the figures are drawn in a process pool, so draw and args
+    must pickle.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    manifest = load_manifest(outdir)
+    todo = []
+    for name, draw, args in figures:
+        filename = figure_filename(name, fmt)
+        key = fingerprint(draw, args)
+        if force or manifest.get(filename) != key or not os.path.exists(os.path.join(outdir, filename)):
+            todo.append((draw, args, os.path.join(outdir, filename)))
+        manifest[filename] = key
+
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(draw_figure, *zip(*todo)))
+    else:
+        for draw, args, filename in todo:
+            draw_figure(draw, args, filename)
+
+    save_manifest(outdir, manifest)
+    return len(todo), len(figures) - len(todo)
+
+
+def show(plt, figures, nrows=None, ncols=None):
+    """Draw all figures as subplots of one figure, return the grid of axes
+
+    The grid is as square as possible unless nrows and ncols are given.
+    """
+    if nrows is None:
+        nrows = ncols = math.ceil(len(figures)**0.5)
+    fig, axs = plt.subplots(nrows=nrows, ncols=ncols, squeeze=False)
+    for ax, (__, draw, args) in zip(axs.flat, figures):
+        draw(ax, *args)
+    return axs
@@ -0,0 +1,88 @@
+import contextlib
+import functools
+import logging
+import sys
+import time
+
+
+# Instrumentation shared by the command line tools.
+#
+# setup() configures logging, where debug output goes to stdout like the
+# prints it replaced and is dropped unless the tool runs verbose, and
+# optionally turns on stage timings and cProfile. Code marks its stages with
+# `with stage('load'):` or @timed('load'), which cost a function call when
+# timings are off.
+# finish() stops the profiler and writes the reports to stderr.
+
+TIMINGS = {} # stage -> [calls, seconds]
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Write to whatever sys.stdout is at the time, like print does"""
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+timing = False
+profiler = None
+profile_file = None
+
+
+def setup(level=logging.INFO, timings=False, profile=None):
+    """Configure logging, and timings and profiling if asked for"""
+    global timing, profiler, profile_file
+    logging.basicConfig(handlers=[StdoutHandler()], format='%(message)s')
+    logging.getLogger().setLevel(level)
+    timing = timings
+    if profile is not None:
+        import cProfile
+        profile_file = profile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Add the wall time of the block to the timings of stage name"""
+    if not timing:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        t = TIMINGS.setdefault(name, [0, 0.0])
+        t[0] += 1
+        t[1] += time.perf_counter() - start
+
+
+def timed(name):
+    """Decorator that runs the whole function as stage name"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def finish():
+    """Stop profiling and report, call once when the command is done"""
+    global profiler
+    if profiler is not None:
+        import pstats
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        stats = pstats.Stats(profile_file, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(20)
+        profiler = None
+    if timing and TIMINGS:
+        print('{:<12} {:>8} {:>10}'.format('stage', 'calls', 'seconds'), file=sys.stderr)
+        for name, (calls, seconds) in TIMINGS.items():
+            print('{:<12} {:>8} {:>10.4f}'.format(name, calls, seconds), file=sys.stderr)
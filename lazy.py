@@ -0,0 +1,17 @@
+import importlib
+
+
+class LazyModule():
+    """Stand-in for a module that is imported on first attribute access
+
+    Lets command line tools keep module level names like np without paying
+    for the import in commands that never touch them.
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import os
+import zlib
+
+from records import RECORD_FIELDNAMES, record_storage, complete_length, exercise_names
+
+
+# Date range and exercise queries over the record.
+#
+# The CSV record is split into blocks of BLOCK_ROWS consecutive rows, and a
+# sidecar next to it keeps the byte range and the earliest and latest date of
+# each block. A query only reads the blocks whose date span overlaps the
+# requested range. Rows are mostly appended in date order, so this is
+# usually a few blocks at the end of the file, but rows out of order are
+# still found since every block knows its own span.
+#
+# Every block also keeps a checksum of its bytes, and the sidecar the size and
+# modification time of the record it was built from. While those still match
+# the index is used as it is; once they change, the checksums are checked so
+# an edit inside the record is noticed even if it keeps the file the same
+# length. The index is kept up to the first block that no longer matches, and
+# the record is scanned again from there, together with any new rows.
+
+BLOCK_ROWS = 256
+
+
+def date_index_filename(rf):
+    return rf + '.dateindex'
+
+
+def scan_blocks(rf, start, end):
+    """Index the rows of an open record file between byte offsets start and end"""
+    blocks = []
+    rf.seek(start)
+    offset = start
+    rows = 0
+    first = last = None
+    while offset < end:
+        line = rf.readline()
+        date = line[:line.find(b',')].decode()
+        if rows == 0:
+            block_start = offset
+            first = last = date
+        first = min(first, date)
+        last = max(last, date)
+        rows += 1
+        offset += len(line)
+        if rows == BLOCK_ROWS or offset >= end:
+            blocks.append([block_start, offset, rows, first, last, block_crc(rf, block_start, offset)])
+            rf.seek(offset)
+            rows = 0
+    return blocks
+
+
+def block_crc(rf, start, end):
+    rf.seek(start)
+    return zlib.crc32(rf.read(end - start))
+
+
+def valid_blocks(rf, blocks, end):
+    """The leading blocks that still lie within end and match their checksums"""
+    for i, block in enumerate(blocks):
+        if len(block) != 6 or block[1] > end or block_crc(rf, block[0], block[1]) != block[5]:
+            return blocks[:i]
+    return blocks
+
+
+def load_date_index(rf_name):
+    """Return the up to date list of [start, end, rows, first date, last date, crc] blocks"""
+    with open(rf_name, 'rb') as rf:
+        header = len(rf.readline())
+        st = os.fstat(rf.fileno())
+        stamp = [st.st_size, st.st_mtime_ns]
+        end = complete_length(rf.fileno(), st.st_size)
+        blocks = []
+        try:
+            with open(date_index_filename(rf_name), 'r') as idf:
+                sidecar = json.load(idf)
+            indexed = sidecar['blocks']
+            if sidecar.get('stamp') == stamp and indexed and indexed[-1][1] == end:
+                return indexed
+            blocks = valid_blocks(rf, indexed, end)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            indexed = None
+        # touched but unchanged, only the stamp is renewed
+        if not (blocks and blocks == indexed and blocks[-1][1] == end):
+            # an unfinished last block is redone together with the new rows
+            if blocks and blocks[-1][2] < BLOCK_ROWS:
+                blocks.pop()
+            start = blocks[-1][1] if blocks else header
+            blocks = blocks + scan_blocks(rf, start, end)
+        sidecar = {'blocks': blocks, 'stamp': stamp}
+
+    try:
+        tmp = date_index_filename(rf_name) + '.tmp'
+        with open(tmp, 'w') as idf:
+            json.dump(sidecar, idf)
+        os.replace(tmp, date_index_filename(rf_name))
+    except OSError:
+        pass # a read-only directory should not prevent queries
+    return blocks
+
+
+def wanted_ranges(blocks, since, until):
+    """Byte ranges of the blocks that can hold dates in [since, until], adjacent ones merged"""
+    ranges = []
+    for start, end, __, first, last, __ in blocks:
+        if (since is not None and last < since) or (until is not None and first > until):
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def in_range(row, since, until, exercise):
+    return (
+        (since is None or row['date'] >= since)
+        and (until is None or row['date'] <= until)
+        and (exercise is None or row['exercise'] == exercise)
+    )
+
+
+def query_csv(rf_name, since=None, until=None, exercise=None):
+    blocks = load_date_index(rf_name)
+    with open(rf_name, 'rb') as rf:
+        for start, end in wanted_ranges(blocks, since, until):
+            rf.seek(start)
+            text = io.StringIO(rf.read(end - start).decode())
+            for row in csv.DictReader(text, fieldnames=RECORD_FIELDNAMES):
+                if in_range(row, since, until, exercise):
+                    yield row
+
+
+def query_columns(ctrl, since=None, until=None, exercise=None):
+    """Return (columns, exercise names) of the rows query() would yield, as typed colstore columns"""
+    import colstore # needs numpy, which csv storage does not
+    if record_storage(ctrl) != 'columnar':
+        exercises = exercise_names(ctrl['DATABASE']['filename'])
+        rows = query_csv(ctrl['RECORD']['filename'], since, until, exercise)
+        return colstore.rows_to_columns(rows, {x: i for i, x in enumerate(exercises)}), exercises
+
+    cols, exercises = colstore.load(
+        ctrl['RECORD']['columns'],
+        ctrl['RECORD']['filename'],
+        ctrl['DATABASE']['filename']
+    )
+    mask = True
+    if since is not None:
+        mask = mask & (cols['date'] >= colstore.to_day(since))
+    if until is not None:
+        mask = mask & (cols['date'] <= colstore.to_day(until))
+    if exercise is not None:
+        if exercise not in exercises:
+            return {name: v[:0] for name, v in cols.items()}, exercises
+        mask = mask & (cols['exercise'] == exercises.index(exercise))
+    if mask is not True:
+        cols = {name: v[mask] for name, v in cols.items()}
+    return cols, exercises
+
+
+def query(ctrl, since=None, until=None, exercise=None):
+    """Yield record rows as dicts of strings with since <= date <= until for one exercise
+
+    Dates are ISO strings, exercise is a canonical name, None means no filter.
+    """
+    if record_storage(ctrl) == 'columnar':
+        import colstore
+        yield from colstore.iter_rows(*query_columns(ctrl, since, until, exercise))
+    else:
+        yield from query_csv(ctrl['RECORD']['filename'], since, until, exercise)
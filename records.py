@@ -0,0 +1,207 @@
+import configparser
+import contextlib
+import csv
+import fcntl
+import io
+import json
+import os
+
+
+RECORD_FIELDNAMES = ['date', 'exercise', 'sets', 'reps', 'weight', 'rpe', 'bodyweight']
+DATABASE_FIELDNAMES = ['exercise', 'aliases', 'bwratio']
+
+
+##########################
+### CONTROL AND RECORD ###
+##########################
+
+
+def read_control(inf):
+    ctrl = configparser.ConfigParser()
+    ctrl.read(inf)
+    return ctrl
+
+
+def record_storage(ctrl):
+    return ctrl['RECORD'].get('storage', 'csv')
+
+
+def exercise_names(dbfile):
+    """Exercise names in database order, the position is the exercise id"""
+    with open(dbfile, 'r') as dbf:
+        return [row['exercise'] for row in csv.DictReader(dbf)]
+
+
+######################
+### LOCKED APPENDS ###
+######################
+
+# Everything that writes to the record file holds an exclusive advisory lock
+# (flock) while it does so. Appends format all their rows up front and put
+# them down in a single write. Compaction takes the same lock before it
+# truncates the log.
+#
+# A truncation (a cut) is first written down in a .cut file next to the
+# record, with the length to cut to and a generation number, and marked done
+# once the file is cut. Anything that takes the lock finishes an interrupted
+# cut before writing, so while a cut is not done nothing has been appended
+# after it. Readers compare the generation with the one they last saw to
+# tell whether the record was cut since.
+
+
+@contextlib.contextmanager
+def locked(f):
+    """Hold an exclusive flock on an open file"""
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield f
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def format_rows(rows):
+    buf = io.StringIO()
+    wtr = csv.DictWriter(buf, fieldnames=RECORD_FIELDNAMES)
+    wtr.writerows(rows)
+    return buf.getvalue().encode()
+
+
+def complete_length(fd, end):
+    """Length of the file up to and including its last newline"""
+    pos = end
+    while pos > 0:
+        start = max(0, pos - 4096)
+        i = os.pread(fd, pos - start, start).rfind(b'\n')
+        if i >= 0:
+            return start + i + 1
+        pos = start
+    return 0
+
+
+def cut_filename(rf_name):
+    return rf_name + '.cut'
+
+
+def read_cut(rf_name):
+    """The last {'generation', 'length', 'done'} cut of a record file, or None"""
+    try:
+        with open(cut_filename(rf_name), 'r') as cf:
+            return json.load(cf)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cut(rf_name, cut):
+    tmp = cut_filename(rf_name) + '.tmp'
+    with open(tmp, 'w') as cf:
+        json.dump(cut, cf)
+        cf.flush()
+        os.fsync(cf.fileno())
+    os.replace(tmp, cut_filename(rf_name))
+
+
+def finish_cut(rf_name, fd):
+    """Complete an interrupted cut, call with the lock held"""
+    cut = read_cut(rf_name)
+    if cut is not None and not cut['done']:
+        os.truncate(fd, cut['length'])
+        cut['done'] = True
+        write_cut(rf_name, cut)
+
+
+def cut_record(rf_name, fd, length, generation):
+    """Truncate the record to length as cut number generation, call with the lock held"""
+    write_cut(rf_name, {'generation': generation, 'length': length, 'done': False})
+    os.truncate(fd, length)
+    os.fsync(fd)
+    write_cut(rf_name, {'generation': generation, 'length': length, 'done': True})
+
+
+def append_record(rf, rows):
+    """Append rows to a record file opened in 'a+b' mode, under the lock in one write"""
+    data = format_rows(rows)
+    fd = rf.fileno()
+    with locked(rf):
+        finish_cut(rf.name, fd)
+        end = os.fstat(fd).st_size
+        if end > 0 and os.pread(fd, 1, end - 1) != b'\n':
+            # the last row lacks its newline, e.g. after editing the file by hand
+            data = b'\n' + data
+        rf.write(data)
+        rf.flush()
+
+
+######################
+### EXERCISE INDEX ###
+######################
+
+# The index maps every exercise name and alias to the canonical exercise name.
+# It is cached in a sidecar file next to the database, and rebuilt whenever
+# the database file changes size or modification time.
+
+
+def index_filename(dbfile):
+    return dbfile + '.index'
+
+
+def database_stamp(dbfile):
+    st = os.stat(dbfile)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def build_index(dbfile):
+    index = {}
+    with open(dbfile, 'r') as dbf:
+        rdr = csv.DictReader(dbf)
+        rows = list(rdr)
+    # canonical names take precedence over aliases
+    for row in rows:
+        index.setdefault(row['exercise'], row['exercise'])
+    for row in rows:
+        for alias in row['aliases'].split():
+            index.setdefault(alias, row['exercise'])
+    return index
+
+
+def save_index(dbfile, index):
+    sidecar = {'stamp': database_stamp(dbfile), 'index': index}
+    tmp = index_filename(dbfile) + '.tmp'
+    with open(tmp, 'w') as idf:
+        json.dump(sidecar, idf)
+    os.replace(tmp, index_filename(dbfile))
+
+
+def load_index(dbfile):
+    """Return the alias -> exercise index, rebuilding the sidecar if stale"""
+    try:
+        with open(index_filename(dbfile), 'r') as idf:
+            sidecar = json.load(idf)
+        if sidecar['stamp'] == database_stamp(dbfile):
+            return sidecar['index']
+    except (OSError, ValueError, KeyError):
+        pass
+    index = build_index(dbfile)
+    try:
+        save_index(dbfile, index)
+    except OSError:
+        pass # a read-only directory should not prevent lookups
+    return index
+
+
+def index_conflicts(index, exercise, aliases):
+    """List the names in a prospective database entry that are already taken"""
+    conflicts = []
+    seen = set()
+    for name in [exercise] + list(aliases):
+        if name in index or name in seen:
+            conflicts.append(name)
+        seen.add(name)
+    return conflicts
+
+
+def add_to_index(dbfile, index, exercise, aliases):
+    """Register a freshly appended database entry and refresh the sidecar"""
+    index[exercise] = exercise
+    for alias in aliases:
+        index[alias] = exercise
+    save_index(dbfile, index)
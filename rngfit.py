@@ -1,24 +1,38 @@
 #!/usr/bin/python3
 
 
+import collections
 import csv
 import datetime
+import glob
+import hashlib
+import json
+import logging
 import math
-import random
+import os
 import re
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy, deepcopy
+from functools import partial
 from io import StringIO
-from copy import deepcopy
 
 import click
-import numpy as np
-import toml
-from matplotlib import pyplot as plt
-from matplotlib import cm
-from matplotlib import dates as mdates
-from matplotlib.colors import Normalize
-from matplotlib.dates import MO
-# from scipy.optimize import minimize
-from scipy.optimize import curve_fit
+
+import figures
+import instrument
+from downsample import minmax_indices, take, POINTS
+from instrument import stage, timed
+from lazy import LazyModule
+from records import locked
+
+# numpy and toml are only imported when used, matplotlib and scipy inside
+# the commands that need them, so that entry starts quickly
+np = LazyModule('numpy')
+toml = LazyModule('toml')
+
+logger = logging.getLogger(__name__)
 
 
 def general_epley(weight, reps, slope=29.0):
@@ -39,16 +53,18 @@ def iso_to_date(iso):
 
 
 def get_weights(dates, reference_date=None):
+    dates = np.asarray(dates, dtype='datetime64[D]')
     if reference_date is None:
-        reference_date = max(dates)
-    ages = np.array([abs((reference_date - x).days) for x in dates])
+        reference_date = dates.max()
+    ages = np.abs((np.datetime64(reference_date, 'D') - dates).astype(np.int64))
     age_weights = ages/30 + 1
     return age_weights
 
 
-def fit_rmcurve(amraps, reference_date=None):
+def fit_rmcurve_iterative(amraps, reference_date=None):
     rps = amraps['reps']
     wts = amraps['weight']
+    from scipy.optimize import curve_fit
     age_weights = get_weights(amraps['date'], reference_date)
     res = curve_fit(
         lambda x, y, z: np.array([inverse_general_epley(y, w, z) for w in wts]),
@@ -61,6 +77,104 @@ def fit_rmcurve(amraps, reference_date=None):
     return res[0][0], res[0][1], sigma[0], sigma[1]
 
 
+SWEEP_CHUNK = 512
+
+
+def wls_sweep(x, y, w):
+    """Closed-form weighted fits of y = a*x - b for every row of weights w
+
+    A zero weight leaves a point out. Returns one (orm, slope, sigma_orm,
+    sigma_slope) row per weight row, NaN where the data are degenerate.
+    """
+    n = (w > 0).sum(axis=1)
+    sw = w.sum(axis=1)
+    swx = w @ x
+    swxx = w @ (x*x)
+    swy = w @ y
+    swxy = w @ (x*y)
+    det = swxx*sw - swx*swx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (sw*swxy - swx*swy)/det
+        b = (swx*swxy - swxx*swy)/det
+        slope = b
+        orm = a/b
+
+        # covariance scaled like curve_fit, infinite without degrees of freedom
+        residuals = y - (a[:, None]*x - b[:, None])
+        s2 = np.where(n > 2, (w*residuals**2).sum(axis=1)/(n - 2), np.inf)
+        jtj11 = slope**2*swxx
+        jtj12 = slope*(orm*swxx - swx)
+        jtj22 = orm**2*swxx - 2*orm*swx + sw
+        jdet = jtj11*jtj22 - jtj12**2
+        sigma_orm = np.sqrt(jtj22/jdet*s2)
+        sigma_slope = np.sqrt(jtj11/jdet*s2)
+
+    fits = np.column_stack([orm, slope, sigma_orm, sigma_slope])
+    fits[~((n >= 2) & (det > 1e-12*swxx*sw) & (b != 0) & (jdet > 0))] = np.nan
+    return fits
+
+
+def fit_rmcurve_wls(amraps, reference_date=None):
+    """Closed-form version of fit_rmcurve_iterative, None if the data are degenerate
+
+    reps - 1 = slope*orm/weight - slope is linear in (slope*orm, slope), so
+    the weighted least squares problem curve_fit solves iteratively has an
+    exact solution. The covariance is scaled the same way as curve_fit does
+    (relative sigma), using the jacobian in (orm, slope) at the solution.
+    """
+    x = 1/np.asarray(amraps['weight'], dtype=float)
+    y = np.asarray(amraps['reps'], dtype=float) - 1
+    w = 1/get_weights(amraps['date'], reference_date)**2 # age_weights act as sigma in curve_fit
+    fit = wls_sweep(x, y, w[None, :])[0]
+    if np.isnan(fit[0]):
+        return None
+    return tuple(float(v) for v in fit)
+
+
+def fit_rmcurve(amraps, reference_date=None, solver='wls'):
+    if solver == 'wls':
+        res = fit_rmcurve_wls(amraps, reference_date)
+        if res is not None:
+            return res
+    return fit_rmcurve_iterative(amraps, reference_date)
+
+
+def fit_rmcurve_sweep(amraps, reference_dates=None, solver='wls'):
+    """fit_rmcurve for every date in reference_dates at once
+
+    Without reference_dates, row j is instead the fit of the prefix
+    amraps[:j + 1] at its own latest date (row 0 is NaN, one point can't be
+    fit). The weighted sums for all rows are formed in a few matrix products
+    per chunk of rows instead of one fit call per row.
+    """
+    days = np.asarray(amraps['date'], dtype='datetime64[D]').astype(np.int64)
+    if reference_dates is None:
+        refs = np.maximum.accumulate(days)
+    else:
+        refs = np.asarray(reference_dates, dtype='datetime64[D]').astype(np.int64)
+    x = 1/np.asarray(amraps['weight'], dtype=float)
+    y = np.asarray(amraps['reps'], dtype=float) - 1
+
+    fits = np.full((len(refs), 4), np.nan)
+    if solver == 'wls':
+        for start in range(0, len(refs), SWEEP_CHUNK):
+            chunk = slice(start, start + SWEEP_CHUNK)
+            w = 1/(np.abs(refs[chunk, None] - days)/30 + 1)**2
+            if reference_dates is None:
+                w *= np.arange(len(days)) <= np.arange(len(days))[chunk, None]
+            fits[chunk] = wls_sweep(x, y, w)
+
+    # whatever the closed form could not handle goes through curve_fit
+    for j in np.flatnonzero(np.isnan(fits[:, 0])):
+        if reference_dates is None:
+            if j == 0:
+                continue
+            fits[j] = fit_rmcurve_iterative({k: v[:j + 1] for k, v in amraps.items()})
+        else:
+            fits[j] = fit_rmcurve_iterative(amraps, reference_dates[j])
+    return fits
+
+
 def parse_amraps(amrap_string):
     amrap_buffer = StringIO(amrap_string)
     rdr = csv.DictReader(amrap_buffer)
@@ -75,16 +189,645 @@ def parse_amraps(amrap_string):
                 v = int(v)
             amraps[k].append(v)
     amraps = {k: np.array(v) for k, v in amraps.items()}
+    if 'date' in amraps:
+        amraps['date'] = amraps['date'].astype('datetime64[D]')
+    return amraps
+
+
+# Every exercise's AMRAPs are also kept pre-parsed in one structured .npy
+# sidecar (rows grouped by exercise, offsets in a .json next to it) that is
+# memory mapped on load. It is current while the TOML and journal files have
+# the same mtime and size as when it was written, or failing that, the same
+# content hash. load_db() takes the stamp before it reads the files and hashes
+# the bytes it read, and the sidecar is written with that state, so an AMRAP
+# entered while the database is loaded can't end up stamped as included.
+
+def amrap_dtype():
+    return np.dtype([('date', 'datetime64[D]'), ('weight', np.float64), ('reps', np.int64)])
+
+
+def sidecar_filenames(dbfile):
+    return dbfile + '.amraps.npy', dbfile + '.amraps.json'
+
+
+def db_files(dbfile):
+    compacting = find_compacting(dbfile)
+    return [dbfile, journal_filename(dbfile), compacting[0] if compacting else compacting_filename(dbfile, 0)]
+
+
+def files_stamp(filenames):
+    stamp = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+            stamp.append([st.st_mtime_ns, st.st_size])
+        except FileNotFoundError:
+            stamp.append(None)
+    return stamp
+
+
+def read_files(filenames):
+    """The contents of filenames, None for missing files"""
+    contents = []
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as f:
+                contents.append(f.read())
+        except FileNotFoundError:
+            contents.append(None)
+    return contents
+
+
+def contents_hash(contents):
+    h = hashlib.sha1()
+    for data in contents:
+        if data is not None:
+            h.update(data)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def db_stamp(dbfile):
+    return files_stamp(db_files(dbfile))
+
+
+def db_hash(dbfile):
+    return contents_hash(read_files(db_files(dbfile)))
+
+
+def save_amraps(dbfile, amraps, state):
+    npyfile, metafile = sidecar_filenames(dbfile)
+    offsets = {}
+    n = 0
+    for exercise, x in amraps.items():
+        offsets[exercise] = [n, n + len(x['date'])]
+        n += len(x['date'])
+    table = np.empty(n, dtype=amrap_dtype())
+    for exercise, (start, end) in offsets.items():
+        for field in table.dtype.names:
+            table[field][start:end] = amraps[exercise][field]
+    with open(npyfile + '.tmp', 'wb') as f:
+        np.save(f, table)
+    os.replace(npyfile + '.tmp', npyfile)
+    with open(metafile + '.tmp', 'w') as f:
+        json.dump({'stamp': state['stamp'], 'hash': state['hash'], 'offsets': offsets}, f)
+    os.replace(metafile + '.tmp', metafile)
+
+
+@timed('load')
+def load_amraps(dbfile, db, state):
+    """parse_amraps for every exercise in db, from the sidecar when it matches the state load_db read db in"""
+    npyfile, metafile = sidecar_filenames(dbfile)
+    try:
+        with open(metafile, 'r') as f:
+            meta = json.load(f)
+        if meta['stamp'] != state['stamp']:
+            if meta['hash'] != state['hash']:
+                raise ValueError('stale sidecar')
+            meta['stamp'] = state['stamp'] # touched but unchanged
+            with open(metafile + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(metafile + '.tmp', metafile)
+        if set(meta['offsets']) != set(db['exercises']):
+            raise ValueError('stale sidecar')
+        table = np.load(npyfile, mmap_mode='r')
+        return {
+            exercise: {field: table[field][start:end] for field in table.dtype.names}
+            for exercise, (start, end) in meta['offsets'].items()
+        }
+    except (OSError, ValueError, KeyError):
+        pass
+
+    amraps = {exercise: parse_amraps(db[exercise]['amraps']) for exercise in db['exercises']}
+    try:
+        save_amraps(dbfile, amraps, state)
+    except OSError:
+        pass
     return amraps
 
 
+# New AMRAPs are appended to a journal next to the TOML instead of rewriting
+# it, readers merge the journal in and compact folds it back into the TOML.
+# While compacting, the journal is moved aside under the next generation
+# number, and the TOML records the generation it absorbed last, so a
+# compaction interrupted after the TOML was replaced is not merged twice.
+# Appends and compaction hold a lock on a separate lock file, so no AMRAP is
+# written to a journal that is being moved aside.
+
+JOURNAL_FIELDNAMES = ['exercise', 'date', 'reps', 'weight']
+
+
+def journal_filename(dbfile):
+    return dbfile + '.journal'
+
+
+def compacting_filename(dbfile, generation):
+    return dbfile + '.journal.compacting.' + str(generation)
+
+
+def lock_filename(dbfile):
+    return dbfile + '.lock'
+
+
+def find_compacting(dbfile):
+    """(filename, generation) of a journal moved aside for compaction, or None"""
+    for filename in glob.glob(glob.escape(dbfile) + '.journal.compacting.*'):
+        generation = filename.rsplit('.', 1)[1]
+        if generation.isdigit():
+            return filename, int(generation)
+    return None
+
+
+def append_amrap_row(db, exercise, row):
+    amraps = db[exercise]['amraps']
+    if not amraps.endswith('\n'):
+        amraps += '\n'
+    fieldnames = amraps.split('\n', 1)[0].rstrip().split(',')
+    csv_buffer = StringIO()
+    wtr = csv.DictWriter(csv_buffer, fieldnames=fieldnames, lineterminator='\n', extrasaction='ignore')
+    wtr.writerow(row)
+    db[exercise]['amraps'] = amraps + csv_buffer.getvalue()
+
+
+def read_journal(filename):
+    """Return the raw bytes and rows of a journal, ignoring a torn last line"""
+    try:
+        with open(filename, 'rb') as jf:
+            return parse_journal(jf.read())
+    except FileNotFoundError:
+        return b'', []
+
+
+def parse_journal(data):
+    data = data[:data.rfind(b'\n') + 1]
+    rdr = csv.DictReader(StringIO(data.decode()), fieldnames=JOURNAL_FIELDNAMES)
+    return data, list(rdr)
+
+
+def merge_journal(db, rows):
+    """Append journal rows to db, return the rows of exercises not in db"""
+    unknown = []
+    for row in rows:
+        if row['exercise'] in db:
+            append_amrap_row(db, row['exercise'], row)
+        else:
+            unknown.append(row)
+    return unknown
+
+
+@timed('load')
+def load_db(dbfile):
+    """toml.load the database with the journaled AMRAPs merged in, return (db, state)
+
+    state holds the stamp of the database files from before they were read
+    and the hash of what was read, for the files derived from db.
+    """
+    filenames = db_files(dbfile)
+    stamp = files_stamp(filenames)
+    contents = read_files(filenames)
+    if contents[0] is None:
+        raise FileNotFoundError(2, 'No such file or directory', dbfile)
+    db = toml.loads(contents[0].decode())
+    generation = int(filenames[2].rsplit('.', 1)[1]) # of the journal moved aside, if any
+    if contents[2] is not None and generation > db.get('compacted_generation', 0):
+        __, rows = parse_journal(contents[2])
+        merge_journal(db, rows)
+    __, rows = parse_journal(contents[1] or b'')
+    for row in merge_journal(db, rows):
+        print('Journaled exercise', row['exercise'], 'not in database, ignored.', file=sys.stderr)
+    return db, {'stamp': stamp, 'hash': contents_hash(contents)}
+
+
+def write_journal(dbfile, row):
+    """Append row to the journal, call with the lock held"""
+    csv_buffer = StringIO()
+    wtr = csv.DictWriter(csv_buffer, fieldnames=JOURNAL_FIELDNAMES, lineterminator='\n')
+    wtr.writerow(row)
+    with open(journal_filename(dbfile), 'a') as jf:
+        jf.write(csv_buffer.getvalue())
+        jf.flush()
+        os.fsync(jf.fileno())
+
+
+def append_journal(dbfile, row):
+    with open(lock_filename(dbfile), 'a') as lf, locked(lf):
+        write_journal(dbfile, row)
+
+
+def in_database(dbfile, exercise):
+    """Check for the [exercise] table without parsing the whole TOML"""
+    pattern = r'^\[("?)' + re.escape(exercise) + r'\1\]\s*$'
+    with open(dbfile, 'r') as db:
+        return re.search(pattern, db.read(), re.MULTILINE) is not None
+
+
+def fold_journal(dbfile, compacting, generation):
+    """Merge a moved-aside journal into the TOML and remove it, call with the lock held"""
+    db = toml.load(dbfile)
+    n_moved = 0
+    if generation > db.get('compacted_generation', 0):
+        __, rows = read_journal(compacting)
+        unknown = merge_journal(db, rows)
+        db['compacted_generation'] = generation
+        tmp = dbfile + '.tmp'
+        with open(tmp, 'w') as out_toml:
+            toml.dump(db, out_toml)
+            out_toml.flush()
+            os.fsync(out_toml.fileno())
+        os.replace(tmp, dbfile)
+        n_moved = len(rows) - len(unknown)
+        for row in unknown:
+            print('Journaled exercise', row['exercise'], 'not in database, kept in journal.', file=sys.stderr)
+            write_journal(dbfile, row)
+    os.remove(compacting)
+    return n_moved
+
+
+def compact_journal(dbfile):
+    """Fold the journal into the TOML, return the number of AMRAPs moved"""
+    n_moved = 0
+    with open(lock_filename(dbfile), 'a') as lf, locked(lf):
+        # finish an interrupted compaction before moving the live journal aside
+        compacting = find_compacting(dbfile)
+        if compacting is not None:
+            n_moved += fold_journal(dbfile, *compacting)
+        if os.path.exists(journal_filename(dbfile)):
+            generation = toml.load(dbfile).get('compacted_generation', 0) + 1
+            compacting = compacting_filename(dbfile, generation)
+            os.replace(journal_filename(dbfile), compacting)
+            n_moved += fold_journal(dbfile, compacting, generation)
+    return n_moved
+
+
 def round_to(x, base):
     return base * round(float(x) / base)
 
 
+def map_exercises(func, *iterables, jobs=1):
+    """list(map(func, *iterables)), spread over a process pool if jobs > 1"""
+    if jobs > 1 and len(iterables[0]) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(func, *iterables))
+    return list(map(func, *iterables))
+
+
+def fit_exercise(amraps, solver='wls'):
+    return list(fit_rmcurve(amraps, solver=solver))
+
+
+def sweep_dates(amraps, future=True):
+    """Reference dates plottime fits at, None meaning every prefix of the AMRAPs"""
+    if future:
+        return np.arange(amraps['date'][0], amraps['date'][-1], dtype='datetime64[D]')
+    return None
+
+
+def sweep_exercise(amraps, future=True, solver='wls'):
+    return fit_rmcurve_sweep(amraps, sweep_dates(amraps, future), solver).tolist()
+
+
+def rmcurve_panel(amraps, fit):
+    """Everything plotfit draws for one exercise"""
+    x_axis = np.linspace(1, 15, 100)
+    orm, slope, sigma_orm, sigma_slope = fit
+    return {
+        'amraps': amraps,
+        'orm': orm,
+        'slope': slope,
+        'x_axis': x_axis,
+        'rmcurve': forward_general_epley(orm, x_axis, slope),
+        'weights': get_weights(amraps['date']),
+        'upper_rmcurve': forward_general_epley(orm, x_axis, slope + sigma_slope) + sigma_orm,
+        'lower_rmcurve': forward_general_epley(orm, x_axis, slope - sigma_slope) - sigma_orm,
+    }
+
+
+def rmtime_panel(amraps, fits, future=True, rms=(1, 5, 10)):
+    """Everything plottime draws for one exercise"""
+    if future:
+        x_axis = sweep_dates(amraps, future)
+    else:
+        x_axis = amraps['date'][1:]
+        fits = fits[1:]
+    rm_axis = []
+    rm_axis_lower = []
+    rm_axis_upper = []
+    for orm, slope, sigma_orm, sigma_slope in fits:
+        rm_axis.append([round(forward_general_epley(orm, x, slope), 1) for x in rms])
+        rm_axis_upper.append([round(forward_general_epley(orm, x, slope + sigma_slope) + sigma_orm, 1) for x in rms])
+        rm_axis_lower.append([round(forward_general_epley(orm, x, slope - sigma_slope) - sigma_orm, 1) for x in rms])
+    return {
+        'x_axis': x_axis,
+        'rm_axis': rm_axis,
+        'rm_axis_lower': rm_axis_lower,
+        'rm_axis_upper': rm_axis_upper,
+    }
+
+
+def downsample_rmtime(panel, points=POINTS):
+    """rmtime_panel output with its days downsampled, keeping every line's and band's extremes"""
+    if len(panel['x_axis']) == 0:
+        return panel
+    series = [np.asarray(panel[x], dtype=np.float64).reshape(len(panel['x_axis']), -1).T
+              for x in ['rm_axis', 'rm_axis_lower', 'rm_axis_upper']]
+    idx = minmax_indices(np.concatenate(series), points)
+    return {name: take(v, idx) for name, v in panel.items()}
+
+
+class FitCache():
+    """Fit results on disk, keyed by the AMRAP block and the fit settings
+
+    Every entry is its own small JSON file in a directory, so a lookup only
+    reads the entries it needs and a hit writes nothing but the file's mtime.
+    Entries are evicted least recently used first, by mtime, once there are
+    more than max_entries.
+    """
+    def __init__(self, dirname, max_entries=1024):
+        self.dirname = dirname
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.n_put = 0
+
+    @staticmethod
+    def key(amrap_string, settings):
+        return hashlib.sha1(json.dumps([amrap_string, settings]).encode()).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.dirname, key + '.json')
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        try:
+            with open(self.filename(key), 'r') as cf:
+                fit = json.load(cf)['fit']
+            os.utime(self.filename(key)) # marks it as recently used
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fit
+
+    def put(self, key, exercise, fit):
+        if self.max_entries <= 0:
+            return
+        if not os.path.isdir(self.dirname):
+            if os.path.exists(self.dirname):
+                os.remove(self.dirname) # single file cache of an older version
+            os.makedirs(self.dirname, exist_ok=True)
+        tmp = self.filename(key) + '.tmp' + str(os.getpid())
+        with open(tmp, 'w') as cf:
+            json.dump({'exercise': exercise, 'fit': fit}, cf)
+        os.replace(tmp, self.filename(key))
+        self.n_put += 1
+
+    def entries(self):
+        """The entry files, least recently used first"""
+        try:
+            names = [x for x in os.listdir(self.dirname) if x.endswith('.json')]
+        except OSError:
+            return []
+        mtimes = {}
+        for name in names:
+            try:
+                mtimes[name] = os.path.getmtime(os.path.join(self.dirname, name))
+            except OSError:
+                pass # evicted by another process
+        return [os.path.join(self.dirname, x) for x in sorted(mtimes, key=mtimes.get)]
+
+    def evict(self):
+        """Remove the least recently used entries over max_entries, only needed after puts"""
+        if self.n_put == 0:
+            return
+        entries = self.entries()
+        for filename in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+@timed('fit')
+def cached_fits(control, func, db, amraps, settings, exercises=None):
+    """func(amraps) for every exercise in db, or just exercises, only computing what is not in the fit cache"""
+    if exercises is None:
+        exercises = db['exercises']
+    cache = FitCache(control.cachedir, control.cache_size)
+    keys = [cache.key(db[exercise]['amraps'], settings) for exercise in exercises]
+    fits = [cache.get(k) for k in keys]
+    missing = [i for i, fit in enumerate(fits) if fit is None]
+    computed = map_exercises(func, [amraps[exercises[i]] for i in missing], jobs=control.jobs)
+    for i, fit in zip(missing, computed):
+        fits[i] = fit
+        cache.put(keys[i], exercises[i], fit)
+    cache.evict()
+    logger.debug('Fit cache: %d hits, %d misses', cache.hits, cache.misses)
+    return fits
+
+
+# Plans are written from a template, where a line such as
+#   squat [3x5;r2 5x3;f0.9] rest 3 min
+# prescribes one of the bracketed options, picked at random, and becomes
+#   squat 5x3x142.5 rest 3 min
+# rN means N reps in reserve, fX means reps at X of the load the reps could be
+# done with. The weights of all options are computed in one pass before any
+# are picked, so many variants of a plan cost little more than one.
+
+RE_PLAN = re.compile(r'(.*)\[(.*)\](.*)$')
+RE_OPTIONS = re.compile(r'(\d+)x(\d+);([rf])(\d+\.?\d*)')
+
+
+def read_plan(infile):
+    """Template lines, with the prescriptions as (prefix, exercise, options, suffix)"""
+    lines = []
+    with open(infile, 'r') as input:
+        for line in input:
+            logger.debug('%s', line)
+            plan = RE_PLAN.match(line)
+            options = RE_OPTIONS.findall(plan.groups()[1]) if plan is not None else []
+            if not options:
+                lines.append(line)
+                continue
+            logger.debug('%s', plan.groups())
+            logger.debug('%s', options)
+            prefix, __, suffix = plan.groups()
+            lines.append((prefix, prefix.rstrip(), options, suffix))
+    return lines
+
+
+def plan_exercises(lines):
+    return sorted(set(line[1] for line in lines if not isinstance(line, str)))
+
+
+def plan_options(lines, db, fits):
+    """Return the sets x reps x weight text of every option, and the first option and option count of every prescription
+
+    fits maps the exercises of the plan to their (orm, slope, ...).
+    """
+    prescriptions = [line for line in lines if not isinstance(line, str)]
+    options = [option for __, __, opts, __ in prescriptions for option in opts]
+    n_options = np.array([len(opts) for __, __, opts, __ in prescriptions], dtype=np.int64)
+    exercises = [exercise for __, exercise, __, __ in prescriptions]
+    if not options:
+        return [], n_options, n_options
+
+    sets = np.array([int(x[0]) for x in options])
+    reps = np.array([int(x[1]) for x in options])
+    vol = np.array([float(x[3]) for x in options])
+    relative = np.array([x[2] == 'f' for x in options])
+    hidden_reps = reps + vol
+    hidden_reps[relative] = reps[relative]/vol[relative]
+    orm = np.repeat([fits[x][0] for x in exercises], n_options)
+    slope = np.repeat([fits[x][1] for x in exercises], n_options)
+    rounding = np.repeat([db[x]['rounding'] for x in exercises], n_options)
+
+    weight = forward_general_epley(orm, hidden_reps, slope)
+    logger.debug('%s', weight)
+    weight = rounding*np.round(weight/rounding)
+    logger.debug('%s', weight)
+
+    # an integer rounding gives integer weights, as round_to does
+    whole = np.repeat([isinstance(db[x]['rounding'], int) for x in exercises], n_options)
+    texts = [
+        'x'.join([str(s), str(r), str(int(w) if i else w)])
+        for s, r, w, i in zip(sets.tolist(), reps.tolist(), weight.tolist(), whole.tolist())
+    ]
+    return texts, np.cumsum(n_options) - n_options, n_options
+
+
+def pick_options(first, n_options, n_variants, rng):
+    """Chosen option of every prescription, one row per variant"""
+    return first + rng.integers(0, n_options, size=(n_variants, len(n_options)))
+
+
+def write_plan(outfile, lines, texts, choice):
+    with open(outfile, 'w') as output:
+        i = 0
+        for line in lines:
+            if isinstance(line, str):
+                output.write(line)
+                continue
+            prefix, __, __, suffix = line
+            output.write(prefix + texts[choice[i]] + suffix + '\n')
+            i += 1
+
+
+# RM tables hold, for every exercise, the load predicted by its latest fit
+# for 1 to TABLE_MAX_REPS reps in steps of TABLE_STEP, and the band from the
+# fit's uncertainty, all rounded to the exercise's rounding. They are kept in
+# a JSON file next to the TOML that is current while the database files are
+# unchanged, so a lookup is an index into a list and needs neither numpy nor
+# scipy. The half rep steps cover lookups at half RPE steps.
+
+TABLE_MAX_REPS = 30
+TABLE_STEP = 0.5
+
+
+def table_filename(dbfile):
+    return dbfile + '.rmtable.json'
+
+
+def table_reps():
+    return np.arange(1, TABLE_MAX_REPS + TABLE_STEP/2, TABLE_STEP)
+
+
+def rm_table(fit, rounding):
+    """Rounded load, lower and upper band for every table_reps() reps from (orm, slope, sigma_orm, sigma_slope)"""
+    orm, slope, sigma_orm, sigma_slope = fit
+    reps = table_reps()
+    curves = {
+        'load': forward_general_epley(orm, reps, slope),
+        'lower': forward_general_epley(orm, reps, slope - sigma_slope) - sigma_orm,
+        'upper': forward_general_epley(orm, reps, slope + sigma_slope) + sigma_orm,
+    }
+    # an integer rounding gives integer loads, as round_to does, and a band
+    # that the fit could not bound (too few AMRAPs) is stored as None
+    convert = int if isinstance(rounding, int) else float
+    return {
+        name: [convert(x) if math.isfinite(x) else None for x in (rounding*np.round(v/rounding)).tolist()]
+        for name, v in curves.items()
+    }
+
+
+def save_rm_tables(dbfile, solver, tables, state):
+    """Store tables as fit from the database load_db read in state"""
+    tmp = table_filename(dbfile) + '.tmp'
+    with open(tmp, 'w') as tf:
+        json.dump({
+            'stamp': state['stamp'],
+            'hash': state['hash'],
+            'solver': solver,
+            'max_reps': TABLE_MAX_REPS,
+            'step': TABLE_STEP,
+            'exercises': tables,
+        }, tf, allow_nan=False)
+    os.replace(tmp, table_filename(dbfile))
+
+
+def load_rm_tables(dbfile, solver='wls'):
+    """The stored RM tables by exercise, or None if they are missing or out of date"""
+    try:
+        with open(table_filename(dbfile), 'r') as tf:
+            stored = json.load(tf)
+        if [stored['solver'], stored['max_reps'], stored['step']] != [solver, TABLE_MAX_REPS, TABLE_STEP]:
+            return None
+        if stored['stamp'] != db_stamp(dbfile) and stored['hash'] != db_hash(dbfile):
+            return None
+        return stored['exercises']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def rm_tables(control, exercises=None):
+    """RM tables of exercises, or all exercises, fitting and storing them if the stored ones are out of date"""
+    tables = load_rm_tables(control.dbfile, control.solver)
+    if tables is None:
+        db, state = load_db(control.dbfile)
+        amraps = load_amraps(control.dbfile, db, state)
+        fits = cached_fits(
+            control,
+            partial(fit_exercise, solver=control.solver),
+            db,
+            amraps,
+            {'fit': 'latest', 'solver': control.solver}
+        )
+        tables = {
+            exercise: rm_table(fit, db[exercise]['rounding'])
+            for exercise, fit in zip(db['exercises'], fits)
+        }
+        try:
+            save_rm_tables(control.dbfile, control.solver, tables, state)
+        except OSError:
+            pass
+    if exercises is None:
+        return tables
+    return {exercise: tables[exercise] for exercise in exercises}
+
+
+def lookup(table, reps, rpe=10):
+    """(load, lower, upper) from one exercise's RM table for sets of reps at rpe, None where unknown"""
+    i = round((reps + 10 - rpe - 1)/TABLE_STEP)
+    if not 0 <= i < len(table['load']):
+        raise ValueError('{} reps at RPE {} is outside the RM table'.format(reps, rpe))
+    return table['load'][i], table['lower'][i], table['upper'][i]
+
+
+def athlete_control(control, dbfile):
+    """control for another athlete's database"""
+    other = copy(control)
+    other.dbfile = dbfile + '.toml'
+    other.cachedir = other.dbfile + '.fitcache'
+    return other
+
+
 class Control():
 	def __init__(self):
 		self.dbfile = None
+		self.solver = None
+		self.jobs = None
+		self.cachedir = None
+		self.cache_size = None
 
 
 pass_control = click.make_pass_decorator(Control, ensure=True)
@@ -92,9 +835,24 @@ pass_control = click.make_pass_decorator(Control, ensure=True)
 
 @click.group()
 @click.argument('dbfile', type=str)
+@click.option('--solver', type=click.Choice(['wls', 'iterative']), default='wls',
+              help='Closed-form weighted least squares or scipy curve_fit.')
+@click.option('-j', '--jobs', type=int, default=1,
+              help='Number of processes to fit exercises in.')
+@click.option('--cache-size', type=int, default=1024,
+              help='Maximum number of cached fits, 0 disables the fit cache.')
+@click.option('--verbose', is_flag=True, help='Print debug output.')
+@click.option('--timings', is_flag=True, help='Report wall time and calls per stage on exit.')
+@click.option('--profile', type=click.Path(), help='Write cProfile stats to this file.')
 @pass_control
-def main(control, dbfile):
+def main(control, dbfile, solver, jobs, cache_size, verbose, timings, profile):
+    instrument.setup(logging.DEBUG if verbose else logging.INFO, timings, profile)
+    click.get_current_context().call_on_close(instrument.finish)
     control.dbfile = dbfile + '.toml'
+    control.solver = solver
+    control.jobs = jobs
+    control.cachedir = control.dbfile + '.fitcache'
+    control.cache_size = cache_size
 
 
 @main.command()
@@ -103,191 +861,314 @@ def main(control, dbfile):
 @click.option('-d', '--date', type=str)
 @pass_control
 def entry(control, exercise, amrap, date):
-    db = toml.load(control.dbfile)
+    if not in_database(control.dbfile, exercise):
+        print('Exercise:', exercise, 'not in database. Aborting entry.')
+        return 0
 
     if date == None:
         date = datetime.date.today()
 
     reps, weight = re.match(r'(\d+)x(\d+\.?\d*)', amrap).groups()
-    csv_buffer = StringIO(db[exercise]['amraps'])
-    fieldnames = csv_buffer.__next__()
-    fieldnames = fieldnames.rstrip()
-    fieldnames = fieldnames.split(',')
-    csv_buffer.seek(0, 2)
-    wtr = csv.DictWriter(csv_buffer, fieldnames=fieldnames)
-    wtr.writerow(
+    append_journal(
+        control.dbfile,
         {
+            'exercise': exercise,
             'date': date,
             'reps': reps,
             'weight': weight,
         }
     )
 
-    csv_buffer.seek(0)
-    db[exercise]['amraps'] = csv_buffer.read()
-
-    with open(control.dbfile, 'w') as out_toml:
-        toml.dump(db, out_toml)
-
 
 @main.command()
 @click.option('-i', '--infile', type=click.Path())
-@click.option('-o', '--outfile', type=click.Path())
+@click.option('-o', '--outfile', type=str,
+              help='With several variants or athletes, {variant} and {athlete} in the name are filled in.')
+@click.option('-n', '--variants', type=int, default=1, help='Number of plans to write.')
+@click.option('--seed', type=int, help='Seed for picking options, random if not given.')
+@click.option('-a', '--athlete', type=str, multiple=True, help='Also write plans for this DBFILE.')
 @pass_control
-def parse(control, infile, outfile):
-    db = toml.load(control.dbfile)
-    for exercise in db['exercises']:
-        amraps = parse_amraps(db[exercise]['amraps'])
-        db[exercise]['orm'], db[exercise]['slope'] = fit_rmcurve(amraps)
+def parse(control, infile, outfile, variants, seed, athlete):
+    dbfiles = [control.dbfile[:-len('.toml')]] + list(athlete)
+    names = [os.path.basename(x) for x in dbfiles]
+    several = variants > 1 or len(dbfiles) > 1
+    if (variants > 1 and '{variant}' not in outfile) or (len(dbfiles) > 1 and '{athlete}' not in outfile):
+        print('Several plans need {variant} and {athlete} in the outfile name. Aborting parse.')
+        return 0
+    if len(set(names)) < len(names):
+        print('Athletes:', ', '.join(sorted(set(x for x in names if names.count(x) > 1))),
+              'would share their plans. Aborting parse.')
+        return 0
 
-    re_plan = re.compile(r'(.*)\[(.*)\](.*)$')
-    re_options = re.compile(r'(\d+)x(\d+);([a-z])(\d+\.?\d*)')
+    with stage('parse'):
+        lines = read_plan(infile)
+    exercises = plan_exercises(lines)
+    rng = np.random.default_rng(seed)
 
-    with open(infile, 'r') as input:
-        with open(outfile, 'w') as output:
-            for line in input:
-                print(line)
-                plan = re_plan.match(line)
-                if plan is None:
-                    output.write(line)
-                    continue
-                print(plan.groups())
-                exercise = plan.groups()[0].rstrip()
-                options = re_options.findall(plan.groups()[1])
-                print(options)
-                option = random.choice(options)
-                print(option)
-                sets = int(option[0])
-                reps = int(option[1])
-                vol_marker = option[2]
-                vol = float(option[3])
-                if vol_marker == 'r':
-                    hidden_reps = reps + vol
-                elif vol_marker == 'f':
-                    hidden_reps = reps/vol
-                weight = forward_general_epley(
-                    db[exercise]['orm'],
-                    hidden_reps,
-                    db[exercise]['slope']
-                )
-                print(weight)
-                weight = round_to(weight, db[exercise]['rounding'])
-                print(weight)
-                output.write(
-                    plan.groups()[0] + 'x'.join(
-                        [str(x) for x in [sets, reps, weight]]
-                    ) + plan.groups()[2] + '\n'
+    # check every database before any plan is written
+    athletes = []
+    for dbfile in dbfiles:
+        this_control = athlete_control(control, dbfile)
+        db, state = load_db(this_control.dbfile)
+        for exercise in exercises:
+            if exercise not in db['exercises']:
+                print('Exercise:', exercise, 'not in', this_control.dbfile + '. Aborting parse.')
+                return 0
+        athletes.append((this_control, db, state))
+
+    for name, (this_control, db, state) in zip(names, athletes):
+        amraps = load_amraps(this_control.dbfile, db, state)
+        fits = cached_fits(
+            this_control,
+            partial(fit_exercise, solver=control.solver),
+            db,
+            amraps,
+            {'fit': 'latest', 'solver': control.solver},
+            exercises
+        )
+
+        with stage('parse'):
+            texts, first, n_options = plan_options(lines, db, dict(zip(exercises, fits)))
+            choices = pick_options(first, n_options, variants, rng)
+            for i, choice in enumerate(choices):
+                write_plan(
+                    outfile.format(variant=i + 1, athlete=name) if several else outfile,
+                    lines,
+                    texts,
+                    choice
                 )
 
 
+def draw_rmcurve(ax, exercise, panel):
+    from matplotlib import cm
+    from matplotlib.colors import Normalize
+
+    amraps = panel['amraps']
+    x_axis = panel['x_axis']
+    orm = panel['orm']
+    slope = panel['slope']
+    weights = panel['weights']
+    ax.plot(x_axis, panel['upper_rmcurve'], color='lightgrey', linewidth=1.0, linestyle='--')
+    ax.plot(x_axis, panel['lower_rmcurve'], color='lightgrey', linewidth=1.0, linestyle='--')
+    ax.scatter(amraps['reps'], amraps['weight'],
+               s=weights*10,
+               c=-weights,
+               norm=Normalize(vmin=-max(weights) - 1,
+                              vmax=0),
+               marker='o',
+               cmap=cm.Greys)
+    ax.plot(x_axis, panel['rmcurve'], color='k')
+    ax.text(0.6, 0.6,
+            '\n'.join([str(x) + " RM: " + str(
+                round(forward_general_epley(orm, x, slope), 1)
+            ) for x in [1, 5, 10]]),
+            transform=ax.transAxes)
+    ax.set_xlim(0, 16)
+    ax.set_xticks([1, 5, 10, 15])
+    ax.grid()
+    ax.set_title(exercise)
+
+
+RMTIME_LINESTYLES = ['-', '--', 'dotted']
+
+
+def draw_rmtime(ax, exercise, panel, rms):
+    from matplotlib import dates as mdates
+
+    x_axis = panel['x_axis']
+    rm_axis = panel['rm_axis']
+    rm_axis_lower = panel['rm_axis_lower']
+    rm_axis_upper = panel['rm_axis_upper']
+    for j, rm in enumerate(rms):
+        ax.fill_between(x_axis, [x[j] for x in rm_axis_lower], [x[j] for x in rm_axis_upper], color='lightgrey', alpha=0.5)
+        ax.plot(x_axis, [x[j] for x in rm_axis], color='k', linestyle=RMTIME_LINESTYLES[j])
+    ax.xaxis.set_major_locator(mdates.YearLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+    ax.xaxis.set_minor_locator(mdates.MonthLocator())
+    ax.grid(which='minor')
+    ax.set_title(exercise)
+    ax.format_xdata = mdates.DateFormatter('%Y-%m-%d')
+
+
+def output_options(func):
+    """--output, --format and --force for the plotting commands"""
+    func = click.option('--force', is_flag=True, help='Redraw every figure, even if unchanged.')(func)
+    func = click.option('--format', 'fmt', type=click.Choice(figures.FORMATS), default='png')(func)
+    func = click.option('-o', '--output', type=click.Path(file_okay=False),
+                        help='Save one figure per exercise in this directory instead of showing them.')(func)
+    return func
+
+
 @main.command()
 @pass_control
-def plotfit(control):
-    db = toml.load(control.dbfile)
-
-    n_exercises = len(db['exercises'])
-    grid_size = math.ceil(n_exercises**0.5)
-
-    fig, axs = plt.subplots(nrows=grid_size, ncols=grid_size)
-
-    for i, exercise in enumerate(db['exercises']):
-        this_axs = axs[int(i/grid_size)][i%grid_size]
-        amraps = parse_amraps(db[exercise]['amraps'])
-        x_axis = np.linspace(1, 15, 100)
-        orm, slope, sigma_orm, sigma_slope = fit_rmcurve(amraps)
-        rmcurve = forward_general_epley(orm, x_axis, slope)
-        print(exercise, orm, slope)
-        weights = get_weights(amraps['date'])
-        upper_rmcurve = forward_general_epley(orm, x_axis, slope + sigma_slope) + sigma_orm
-        lower_rmcurve = forward_general_epley(orm, x_axis, slope - sigma_slope) - sigma_orm
-        this_axs.plot(x_axis, upper_rmcurve, color='lightgrey', linewidth=1.0, linestyle='--')
-        this_axs.plot(x_axis, lower_rmcurve, color='lightgrey', linewidth=1.0, linestyle='--')
-        this_axs.scatter(amraps['reps'], amraps['weight'],
-                         s=weights*10,
-                         c=-weights,
-                         norm=Normalize(vmin=-max(weights) - 1,
-                                        vmax=0),
-                         marker='o',
-                         cmap=cm.Greys)
-        this_axs.plot(x_axis, rmcurve, color='k')
-        this_axs.text(0.6, 0.6,
-                      '\n'.join([str(x) + " RM: " + str(
-                          round(forward_general_epley(orm, x, slope), 1)
-                      ) for x in [1, 5, 10]]),
-                      transform=this_axs.transAxes)
-        this_axs.set_xlim(0, 16)
-        this_axs.set_xticks([1, 5, 10, 15])
-        this_axs.grid()
-        this_axs.set_title(exercise)
-
-    plt.tight_layout()
-    plt.show()
+@output_options
+def plotfit(control, output, fmt, force):
+    db, state = load_db(control.dbfile)
+    amraps = load_amraps(control.dbfile, db, state)
+
+    fits = cached_fits(
+        control,
+        partial(fit_exercise, solver=control.solver),
+        db,
+        amraps,
+        {'fit': 'latest', 'solver': control.solver}
+    )
+    with stage('render'):
+        panels = map_exercises(
+            rmcurve_panel,
+            [amraps[exercise] for exercise in db['exercises']],
+            fits,
+            jobs=control.jobs
+        )
+        for exercise, panel in zip(db['exercises'], panels):
+            logger.debug('%s %s %s', exercise, panel['orm'], panel['slope'])
+        exercise_figures = [
+            ('rmcurve-' + exercise, draw_rmcurve, (exercise, panel))
+            for exercise, panel in zip(db['exercises'], panels)
+        ]
+
+        if output is not None:
+            written, unchanged = figures.write(output, exercise_figures, fmt, control.jobs, force)
+        else:
+            from matplotlib import pyplot as plt
+            figures.show(plt, exercise_figures)
+            plt.tight_layout()
+
+    if output is not None:
+        print('Wrote', written, 'figures to', output + ',', unchanged, 'unchanged.')
+    else:
+        plt.show()
 
 
 @main.command()
 @pass_control
 @click.option('--future/--no-future', default=True)
-def plottime(control, future):
-    db = toml.load(control.dbfile)
+@click.option('--points', type=int, default=POINTS,
+              help='Downsample each exercise to about this many days, 0 plots every day.')
+@output_options
+def plottime(control, future, points, output, fmt, force):
+    db, state = load_db(control.dbfile)
+    amraps = load_amraps(control.dbfile, db, state)
+
+    rms = [1, 5, 10]
+    fits = cached_fits(
+        control,
+        partial(sweep_exercise, future=future, solver=control.solver),
+        db,
+        amraps,
+        {'fit': 'sweep', 'future': future, 'solver': control.solver}
+    )
+    with stage('render'):
+        panels = map_exercises(
+            partial(rmtime_panel, future=future, rms=rms),
+            [amraps[exercise] for exercise in db['exercises']],
+            fits,
+            jobs=control.jobs
+        )
+        panels = [downsample_rmtime(x, points) for x in panels]
 
-    n_exercises = len(db['exercises'])
-    grid_size = math.ceil(n_exercises**0.5)
+        if output is not None:
+            # each file spans its own exercise's dates, so that new AMRAPs
+            # for one exercise leave the other figures unchanged
+            exercise_figures = [
+                ('rmtime-' + exercise, draw_rmtime, (exercise, panel, rms))
+                for exercise, panel in zip(db['exercises'], panels)
+            ]
+            written, unchanged = figures.write(output, exercise_figures, fmt, control.jobs, force)
+        else:
+            from matplotlib import pyplot as plt
+            axs = figures.show(plt, [
+                ('rmtime-' + exercise, draw_rmtime, (exercise, panel, rms))
+                for exercise, panel in zip(db['exercises'], panels)
+            ])
 
-    fig, axs = plt.subplots(nrows=grid_size, ncols=grid_size)
+            min_date = min([[x.get_xlim()[0] for x in y] for y in axs])[0]
+            max_date = max([[x.get_xlim()[1] for x in y] for y in axs])[0]
+            for y in axs:
+                for x in y:
+                    x.set_xlim(min_date, max_date)
 
-    years = mdates.YearLocator()
-    years_fmt = mdates.DateFormatter('%Y')
-    months = mdates.MonthLocator()
-    months_fmt = mdates.DateFormatter('%Y-%m')
-    days = mdates.WeekdayLocator(byweekday=MO)
+            plt.tight_layout()
 
-    for i, exercise in enumerate(db['exercises']):
-        this_axs = axs[int(i/grid_size)][i%grid_size]
-        amraps = parse_amraps(db[exercise]['amraps'])
-        if future:
-            x_axis = [amraps['date'][0] + datetime.timedelta(days=x) for x in range((amraps['date'][-1] - amraps['date'][0]).days)]
-        else:
-            x_axis = amraps['date']
-        rm_axis = []
-        rm_axis_lower = []
-        rm_axis_upper = []
-        rms = [1, 5, 10]
-        linestyles = ['-', '--', 'dotted']
-        for j, date in enumerate(x_axis):
-            if future:
-                orm, slope, sigma_orm, sigma_slope = fit_rmcurve(amraps, date)
-                rm_axis.append([round(forward_general_epley(orm, x, slope), 1) for x in rms])
-                rm_axis_upper.append([round(forward_general_epley(orm, x, slope + sigma_slope) + sigma_orm, 1) for x in rms])
-                rm_axis_lower.append([round(forward_general_epley(orm, x, slope - sigma_slope) - sigma_orm, 1) for x in rms])
+    if output is not None:
+        print('Wrote', written, 'figures to', output + ',', unchanged, 'unchanged.')
+    else:
+        plt.show()
+
+
+@main.command()
+@click.argument('exercises', type=str, nargs=-1)
+@click.option('-r', '--reps', type=int, help='Only look up sets of this many reps.')
+@click.option('--rpe', type=float, default=10.0)
+@pass_control
+def table(control, exercises, reps, rpe):
+    """Print predicted loads by reps from the stored RM tables"""
+    tables = rm_tables(control)
+    for exercise in exercises:
+        if exercise not in tables:
+            print('Exercise:', exercise, 'not in database.')
+            return 0
+    if not exercises:
+        exercises = list(tables)
+
+    if reps is not None:
+        for exercise in exercises:
+            try:
+                load, lower, upper = lookup(tables[exercise], reps, rpe)
+            except ValueError as err:
+                print(err)
+                return 0
+            if lower is None or upper is None:
+                print(exercise, load)
             else:
-                if j == 0:
-                    continue
-                old_amraps = {k: v[:j + 1] for k, v in amraps.items()}
-                orm, slope, sigma_orm, sigma_slope = fit_rmcurve(old_amraps)
-                rm_axis.append([round(forward_general_epley(orm, x, slope), 1) for x in rms])
-                rm_axis_upper.append([round(forward_general_epley(orm, x, slope + sigma_slope) + sigma_orm, 1) for x in rms])
-                rm_axis_lower.append([round(forward_general_epley(orm, x, slope - sigma_slope) - sigma_orm, 1) for x in rms])
-        if not future:
-            x_axis = x_axis[1:]
-        for j, rm in enumerate(rms):
-            this_axs.fill_between(x_axis, [x[j] for x in rm_axis_lower], [x[j] for x in rm_axis_upper], color='lightgrey', alpha=0.5)
-            this_axs.plot(x_axis, [x[j] for x in rm_axis], color='k', linestyle=linestyles[j])
-        this_axs.xaxis.set_major_locator(years)
-        this_axs.xaxis.set_major_formatter(years_fmt)
-        this_axs.xaxis.set_minor_locator(months)
-        this_axs.grid(which='minor')
-        this_axs.set_title(exercise)
-        this_axs.format_xdata = mdates.DateFormatter('%Y-%m-%d')
-
-    min_date = min([[x.get_xlim()[0] for x in y] for y in axs])[0]
-    max_date = max([[x.get_xlim()[1] for x in y] for y in axs])[0]
-    for y in axs:
-        for x in y:
-            x.set_xlim(min_date, max_date)
-
-    plt.tight_layout()
-    plt.show()
+                print(exercise, load, '({} - {})'.format(lower, upper))
+        return
 
+    for exercise in exercises:
+        print(exercise)
+        print('{:>6} {:>8} {:>8} {:>8}'.format('reps', 'load', 'lower', 'upper'))
+        for r in range(1, TABLE_MAX_REPS + 1):
+            load, lower, upper = lookup(tables[exercise], r)
+            print('{:>6} {:>8} {:>8} {:>8}'.format(*['-' if x is None else x for x in [r, load, lower, upper]]))
+
+
+@main.command()
+@pass_control
+def compact(control):
+    """Fold the AMRAP journal back into the TOML database"""
+    print('Compacted', compact_journal(control.dbfile), 'AMRAPs.')
+
+@main.group()
+def cache():
+    """Fit cache function group"""
+
+
+@cache.command()
+@pass_control
+def stats(control):
+    """Print the number and size of cached fits"""
+    entries = FitCache(control.cachedir, control.cache_size).entries()
+    exercises = collections.Counter()
+    for filename in entries:
+        try:
+            with open(filename, 'r') as cf:
+                exercises[json.load(cf)['exercise']] += 1
+        except (OSError, ValueError, KeyError):
+            pass
+    print('Entries:', len(entries), '/', control.cache_size)
+    print('Size:', sum(os.path.getsize(x) for x in entries if os.path.exists(x)), 'bytes')
+    for exercise, n in exercises.items():
+        print('\t' + exercise, n)
+
+
+@cache.command()
+@pass_control
+def clear(control):
+    """Remove all cached fits"""
+    if os.path.isdir(control.cachedir):
+        shutil.rmtree(control.cachedir)
+    elif os.path.exists(control.cachedir):
+        os.remove(control.cachedir)
 
 if __name__ == '__main__':
     main()
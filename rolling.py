@@ -0,0 +1,186 @@
+import heapq
+import itertools
+
+import numpy as np
+
+
+# Rolling statistics.
+#
+# The index-window functions use the centered window of analyze.py, which
+# shrinks at the edges: for window w, element i covers
+# v[floor(i - (w - 1)/2) : floor(i + (w - 1)/2 + 1)], clipped to [0, len(v)].
+# The time-window functions instead cover the trailing span of days up to
+# and including each date, so irregular gaps between samples are respected.
+
+
+def window_bounds(n, window=5):
+    """Return the (imin, imax) slice bounds of each centered window"""
+    e = (window - 1) / 2
+    for i in range(n):
+        imin = int(i - e) if i - e > 0 else 0
+        imax = int(i + e + 1) if i + e < n else n
+        yield imin, imax
+
+
+def time_window_bounds(days, span):
+    """Return the (imin, imax) bounds of the trailing span for sorted day numbers"""
+    imin = 0
+    for i, day in enumerate(days):
+        while days[imin] <= day - span:
+            imin += 1
+        yield imin, i + 1
+
+
+class SlidingMedian():
+    """Median of a window that only grows on the right and shrinks on the left
+
+    Two heaps hold the lower and upper half, entries leaving the window are
+    deleted lazily when they surface at the top of a heap.
+    """
+    def __init__(self, v):
+        self.v = v
+        self.low = [] # max-heap of (-value, index)
+        self.high = [] # min-heap of (value, index)
+        self.in_low = {}
+        self.n_low = 0
+        self.n_high = 0
+
+    def _prune(self, heap):
+        while heap and heap[0][1] not in self.in_low:
+            heapq.heappop(heap)
+
+    def _balance(self):
+        self._prune(self.low)
+        self._prune(self.high)
+        if self.n_low > self.n_high + 1:
+            value, i = heapq.heappop(self.low)
+            heapq.heappush(self.high, (-value, i))
+            self.in_low[i] = False
+            self.n_low -= 1
+            self.n_high += 1
+        elif self.n_low < self.n_high:
+            value, i = heapq.heappop(self.high)
+            heapq.heappush(self.low, (-value, i))
+            self.in_low[i] = True
+            self.n_low += 1
+            self.n_high -= 1
+        self._prune(self.low)
+        self._prune(self.high)
+
+    def add(self, i):
+        if self.n_low == 0 or self.v[i] <= -self.low[0][0]:
+            heapq.heappush(self.low, (-self.v[i], i))
+            self.in_low[i] = True
+            self.n_low += 1
+        else:
+            heapq.heappush(self.high, (self.v[i], i))
+            self.in_low[i] = False
+            self.n_high += 1
+        self._balance()
+
+    def remove(self, i):
+        if self.in_low.pop(i):
+            self.n_low -= 1
+        else:
+            self.n_high -= 1
+        self._balance()
+
+    def median(self):
+        if (self.n_low + self.n_high) % 2 == 0:
+            return (-self.low[0][0] + self.high[0][0]) / 2
+        return -self.low[0][0]
+
+
+def bounded_median(v, bounds):
+    """Median of v over each (imin, imax), both bounds must be non-decreasing"""
+    sm = SlidingMedian(v)
+    lo = 0
+    hi = 0
+    mm = []
+    for imin, imax in bounds:
+        while hi < imax:
+            sm.add(hi)
+            hi += 1
+        while lo < imin:
+            sm.remove(lo)
+            lo += 1
+        mm.append(sm.median())
+    return mm
+
+
+def bounded_mean(v, bounds):
+    """Mean of v over each (imin, imax) from a running sum"""
+    cumsum = [0.0] + list(itertools.accumulate(v))
+    return [(cumsum[imax] - cumsum[imin]) / (imax - imin) for imin, imax in bounds]
+
+
+def moving_median(v, window=5):
+    """Centered moving median in O(n log window)"""
+    return bounded_median(v, window_bounds(len(v), window))
+
+
+def moving_mean(v, window=5):
+    """Centered moving mean in O(n)"""
+    return bounded_mean(v, window_bounds(len(v), window))
+
+
+def time_median(days, v, span=14):
+    """Median over the last span days, days must be sorted day numbers"""
+    return bounded_median(v, time_window_bounds(days, span))
+
+
+def time_mean(days, v, span=14):
+    """Mean over the last span days, days must be sorted day numbers"""
+    return bounded_mean(v, time_window_bounds(days, span))
+
+
+#############
+### NUMPY ###
+#############
+
+
+def np_window_bounds(n, window=5):
+    e = (window - 1) / 2
+    i = np.arange(n)
+    imin = np.maximum(np.floor(i - e), 0).astype(int)
+    imax = np.minimum(np.floor(i + e + 1), n).astype(int)
+    return imin, imax
+
+
+def np_time_window_bounds(days, span):
+    days = np.asarray(days)
+    imin = np.searchsorted(days, days - span, side='right')
+    return imin, np.arange(1, len(days) + 1)
+
+
+def np_bounded_mean(v, imin, imax):
+    cumsum = np.concatenate([[0.0], np.cumsum(v, dtype=float)])
+    return (cumsum[imax] - cumsum[imin]) / (imax - imin)
+
+
+def np_moving_mean(v, window=5):
+    """Vectorized centered moving mean"""
+    return np_bounded_mean(v, *np_window_bounds(len(v), window))
+
+
+def np_moving_median(v, window=5):
+    """Vectorized centered moving median
+
+    Full windows go through a sliding window view in one np.median call, the
+    shrunken windows at the edges are done one by one.
+    """
+    v = np.asarray(v, dtype=float)
+    imin, imax = np_window_bounds(len(v), window)
+    mm = np.empty(len(v))
+    full = (imax - imin) == window
+    if full.any():
+        views = np.lib.stride_tricks.sliding_window_view(v, window)
+        mm[full] = np.median(views[imin[full]], axis=1)
+    for i in np.flatnonzero(~full):
+        mm[i] = np.median(v[imin[i]:imax[i]])
+    return mm
+
+
+def np_time_mean(days, v, span=14):
+    """Vectorized mean over the last span days, days must be sorted"""
+    return np_bounded_mean(v, *np_time_window_bounds(days, span))
@@ -4,13 +4,22 @@ import csv
 import configparser
 import click
 import datetime
+import json
+import logging
 import re as re
+import sys
+import time
 
+from records import RECORD_FIELDNAMES, DATABASE_FIELDNAMES, read_control
+from records import load_index, index_conflicts, add_to_index, append_record
+import daemon
+import instrument
+from instrument import stage
 
-VERSION = '0.0.3'
 
-RECORD_FIELDNAMES = ['date', 'exercise', 'sets', 'reps', 'weight', 'rpe', 'bodyweight']
-DATABASE_FIELDNAMES = ['exercise', 'aliases', 'bwratio']
+VERSION = '0.0.3'
+logger = logging.getLogger(__name__)
+IMPORT_BATCH = 10000 # rows per append in rec import
 
 
 class Control():
@@ -19,11 +28,93 @@ class Control():
 		self.inf = None
 		self.dbf = None
 		self.rf = None
+		self.storage = None
+		self.cols = None
+		self.sock = None
 
 
 pass_control = click.make_pass_decorator(Control, ensure=True)
 
 
+def parse_festr(festr):
+	"""Parse SETSxREPSxWEIGHT(@RPE) or REPS,REPS,...,REPSxWEIGHT(@RPE) into (replist, weight, rpe)"""
+	replist = None
+	reps = None
+	rpe = None
+	sets = None
+
+	# Identify set/rep format
+	xform = bool(re.search(r',', festr))
+	if xform:
+		m = re.match(r'\A(.+)x([^@]+)(@(.+))?\Z', festr)
+		if m is None:
+			raise ValueError('Malformed short-form entry: ' + festr)
+		replist, weight, __, rpe = m.groups()
+		replist = replist.split(',')
+		replist = [int(x) for x in replist]
+	else:
+		m = re.match(r'\A(.+)x(.+)x([^@]+)(@(.+))?\Z', festr)
+		if m is None:
+			raise ValueError('Malformed short-form entry: ' + festr)
+		sets, reps, weight, __, rpe = m.groups()
+		reps = int(reps)
+		sets = int(sets)
+
+	# fix types
+	weight = float(weight)
+	if rpe: rpe = float(rpe)
+
+	if replist == None:
+		replist = [reps]*sets
+
+	return replist, weight, rpe
+
+
+def run_lengths(replist):
+	"""Collapse a list of reps into [sets, reps] groups of consecutive equal reps"""
+	snr = []
+	rprev = -1
+	for r in replist:
+		if r == rprev:
+			snr[-1][0] += 1
+		else:
+			snr.append([1, r])
+		rprev = r
+	return snr
+
+
+def parse_date(iso):
+	m = re.match(r'(\d+)-(\d+)-(\d+)\Z', iso)
+	if m is None:
+		raise ValueError('Malformed date: ' + iso)
+	y, m, d = m.groups()
+	return datetime.date(int(y), int(m), int(d))
+
+
+def resolve_exercise(control, exercise):
+	"""Canonical name of an exercise or alias, None if it is not in the database"""
+	with stage('resolve'):
+		reply = daemon.request(control.sock, {'op': 'resolve', 'exercise': exercise})
+		if reply is not None:
+			return reply.get('exercise')
+		return load_index(control.dbf).get(exercise)
+
+
+def append_rows(control, rows):
+	"""Append rows to the record, through the daemon if one is serving this control file"""
+	if not rows:
+		return True
+	with stage('append'):
+		reply = daemon.request(control.sock, {'op': 'append', 'rows': rows})
+		if reply is None:
+			with open(control.rf, 'a+b') as rf:
+				append_record(rf, rows)
+	if reply is not None and not reply['ok']:
+		print('Daemon error:', reply['error'])
+		return False
+	return True
+
+
 ##################
 ### MAIN GROUP ###
 ##################
@@ -31,19 +122,25 @@ pass_control = click.make_pass_decorator(Control, ensure=True)
 @click.group()
 @click.version_option(version=VERSION)
 @click.option('--verbose', is_flag=True, help='Increase output verbosity (maybe).')
+@click.option('--timings', is_flag=True, help='Report wall time and calls per stage on exit.')
+@click.option('--profile', type=click.Path(), help='Write cProfile stats to this file.')
 @click.argument('inf', type=click.Path())
 @pass_control
-def main(control, verbose, inf):
+def main(control, verbose, timings, profile, inf):
 	control.verbose = verbose
 	control.inf = inf
+	instrument.setup(logging.DEBUG if verbose else logging.INFO, timings, profile)
+	click.get_current_context().call_on_close(instrument.finish)
 
 
 @main.command()
 @click.option('--record', type=click.Path(exists=True))
 @click.option('--database', type=click.Path(exists=True))
 @click.option('--username', prompt=True, type=str)
+@click.option('--storage', type=click.Choice(['csv', 'columnar']), default='csv',
+	help='Record backend, columnar keeps compacted records in binary column files.')
 @pass_control
-def init(control, record, database, username):
+def init(control, record, database, username, storage):
 	"""Initialize a set of files"""
 
 	# Create record and database files if they do not exist
@@ -58,12 +155,20 @@ def init(control, record, database, username):
 			wtr = csv.DictWriter(dbf, fieldnames=DATABASE_FIELDNAMES)
 			wtr.writeheader()
 
+	# With columnar storage the record file is the append log in front of the columns
+	if storage == 'columnar':
+		import colstore
+		columns = control.inf + '.columns'
+		colstore.create(columns, record)
 
 	# Write to control file
 	ctrl = configparser.ConfigParser()
 	ctrl['RECORD'] = {}
 	# ctrl['RECORD']['fieldnames'] = ' '.join(RECORD_FIELDNAMES)
 	ctrl['RECORD']['filename'] = record
+	ctrl['RECORD']['storage'] = storage
+	if storage == 'columnar':
+		ctrl['RECORD']['columns'] = columns
 	ctrl['DATABASE'] = {}
 	# ctrl['DATABASE']['fieldnames'] = ' '.join(RECORD_FIELDNAMES)
 	ctrl['DATABASE']['filename'] = database
@@ -74,6 +179,13 @@ def init(control, record, database, username):
 		ctrl.write(inf)
 
 
+@main.command()
+@pass_control
+def serve(control):
+	"""Keep the record open and take entries over a local socket"""
+	daemon.serve(control.inf, daemon.socket_filename(control.inf))
+
+
 ######################
 ### DATABASE GROUP ###
 ######################
@@ -82,8 +194,8 @@ def init(control, record, database, username):
 @pass_control
 def db(control):
 	"""Database-handling function group"""
-	ctrl = configparser.ConfigParser()
-	ctrl.read(control.inf)
+	with stage('control'):
+		ctrl = read_control(control.inf)
 	control.dbf = ctrl['DATABASE']['filename']
 
 
@@ -94,6 +206,12 @@ def db(control):
 @pass_control
 def entry(control, exercise, aliases, bwratio):
 	'''Add an entry to the database'''
+	index = load_index(control.dbf)
+	conflicts = index_conflicts(index, exercise, aliases)
+	if conflicts:
+		print('Name(s) already in database:', ' '.join(conflicts) + '. Aborting entry.')
+		return 0
+
 	with open(control.dbf, 'a') as dbf:
 		wtr = csv.DictWriter(dbf, fieldnames=DATABASE_FIELDNAMES)
 		wtr.writerow({
@@ -101,6 +219,7 @@ def entry(control, exercise, aliases, bwratio):
 			DATABASE_FIELDNAMES[1]: ' '.join(aliases),
 			DATABASE_FIELDNAMES[2]: bwratio
 		})
+	add_to_index(control.dbf, index, exercise, aliases)
 
 
 @db.command()
@@ -123,10 +242,13 @@ def prnt(control):
 @pass_control
 def rec(control):
 	"""Record-handling function group"""
-	ctrl = configparser.ConfigParser()
-	ctrl.read(control.inf)
+	with stage('control'):
+		ctrl = read_control(control.inf)
 	control.dbf = ctrl['DATABASE']['filename']
 	control.rf = ctrl['RECORD']['filename']
+	control.storage = ctrl['RECORD'].get('storage', 'csv')
+	control.cols = ctrl['RECORD'].get('columns')
+	control.sock = daemon.socket_filename(control.inf)
 
 
 @rec.command()
@@ -151,46 +273,41 @@ def entry(control, year, month, day, exercise, sets, reps, weight, rpe, bw):
 		when = datetime.date(when.year, month, when.day)
 	if day != None:
 		when = datetime.date(when.year, when.month, day)
-	print(when)
-
-	with open(control.dbf, 'r') as dbf, open(control.rf, 'a') as rf:
-		rdr = csv.DictReader(dbf)
-		wtr = csv.DictWriter(rf, fieldnames=RECORD_FIELDNAMES)
-
-		# If we want to enter an exerces, make sure it exists
-		if exercise != None:
-			in_db = False
-			for row in rdr:
-				if (exercise == row['exercise'] or exercise in row['aliases'].split()):
-					exercise = row['exercise']
-					in_db = True
-			if not in_db:
-				print('Exercise:', exercise, 'not in database. Aborting entry.')
-				return 0
-
-		# A number of things are contingent, so if we don't have all we might as well have none
-		if exercise == None or reps == None or weight == None:
-			if exercise !=None or reps != None or weight != None:
-				print('Exercise, reps and weight have to be specified together')
-			exercise = None
-			sets = None
-			reps = None
-			weight = None
-			rpe = None
+	logger.info(when)
 
-		if exercise == None and sets == None and reps == None and weight == None and rpe == None and bw == None:
-			print('Nothing to enter.')
+	# If we want to enter an exerces, make sure it exists
+	if exercise != None:
+		canonical = resolve_exercise(control, exercise)
+		if canonical == None:
+			print('Exercise:', exercise, 'not in database. Aborting entry.')
 			return 0
-
-		wtr.writerow({
-			RECORD_FIELDNAMES[0]: when,
-			RECORD_FIELDNAMES[1]: exercise,
-			RECORD_FIELDNAMES[2]: sets,
-			RECORD_FIELDNAMES[3]: reps,
-			RECORD_FIELDNAMES[4]: weight,
-			RECORD_FIELDNAMES[5]: rpe,
-			RECORD_FIELDNAMES[6]: bw
-		})
+		exercise = canonical
+
+	# A number of things are contingent, so if we don't have all we might as well have none
+	if exercise == None or reps == None or weight == None:
+		if exercise !=None or reps != None or weight != None:
+			print('Exercise, reps and weight have to be specified together')
+		exercise = None
+		sets = None
+		reps = None
+		weight = None
+		rpe = None
+
+	if exercise == None and sets == None and reps == None and weight == None and rpe == None and bw == None:
+		print('Nothing to enter.')
+		return 0
+
+	if not append_rows(control, [{
+		RECORD_FIELDNAMES[0]: str(when),
+		RECORD_FIELDNAMES[1]: exercise,
+		RECORD_FIELDNAMES[2]: sets,
+		RECORD_FIELDNAMES[3]: reps,
+		RECORD_FIELDNAMES[4]: weight,
+		RECORD_FIELDNAMES[5]: rpe,
+		RECORD_FIELDNAMES[6]: bw
+	}]):
+		print('Entry not recorded.')
+		return 0
 
 
 @rec.command()
@@ -211,93 +328,186 @@ def fe(control, year, month, day, exercise, festr):
 		when = datetime.date(when.year, month, when.day)
 	if day != None:
 		when = datetime.date(when.year, when.month, day)
-	print(when)
+	logger.info(when)
 
 	# some variables are not used here every time but needed for printing to record
-	replist = None
-	reps = None
-	rpe = None
-	sets = None
 	bw = None
 
-	# Parse the quick string
-	# Identify set/rep format
-	xform = bool(re.search(r',', festr))
-	if xform:
-		replist = re.match(r'\A(.+)x[^@]+(@.+)?', festr).group(1)
-		weight = re.match(r'\A.+x([^@]+)(@.+)?', festr).group(1)
-		rpe = re.match(r'\A.+x[^@]+(@(.+))?', festr).group(2)
-		replist = replist.split(',')
-		replist = [int(x) for x in replist]
-	else:
-		sets = re.match(r'\A(.+)x.+x[^@]+(@.+)?', festr).group(1)
-		reps = re.match(r'\A.+x(.+)x[^@]+(@.+)?', festr).group(1)
-		weight = re.match(r'\A.+x.+x([^@]+)(@.+)?', festr).group(1)
-		rpe = re.match(r'\A.+x.+x[^@]+(@(.+))?', festr).group(2)
-		reps = int(reps)
-		sets = int(sets)
+	with stage('parse'):
+		replist, weight, rpe = parse_festr(festr)
+		snr = run_lengths(replist)
+	logger.info(replist)
+	logger.info(snr)
+
+	# If we want to enter an exerces, make sure it exists
+	if exercise != None:
+		canonical = resolve_exercise(control, exercise)
+		if canonical == None:
+			print('Exercise:', exercise, 'not in database. Aborting entry.')
+			return 0
+		exercise = canonical
 
-	# fix types
-	weight = float(weight)
-	if rpe: rpe = float(rpe)
+	rows = []
+	for x in snr:
+		sets = x[0]
+		reps = x[1]
 
-	if replist == None:
-		replist = [reps]*sets
+		# A number of things are contingent, so if we don't have all we might as well have none
+		if exercise == None or reps == None or weight == None:
+			if exercise !=None or reps != None or weight != None:
+				print('Exercise, reps and weight have to be specified together')
+			exercise = None
+			sets = None
+			reps = None
+			weight = None
+			rpe = None
+
+		if exercise == None and sets == None and reps == None and weight == None and rpe == None and bw == None:
+			print('Nothing to enter.')
+			return 0
 
-	print(replist)
+		rows.append({
+			RECORD_FIELDNAMES[0]: str(when),
+			RECORD_FIELDNAMES[1]: exercise,
+			RECORD_FIELDNAMES[2]: sets,
+			RECORD_FIELDNAMES[3]: reps,
+			RECORD_FIELDNAMES[4]: weight,
+			RECORD_FIELDNAMES[5]: rpe,
+			RECORD_FIELDNAMES[6]: bw
+		})
+	if not append_rows(control, rows):
+		print('Entry not recorded.')
+		return 0
 
-	snr = []
-	rprev = -1
-	for r in replist:
-		if r == rprev:
-			snr[-1][0] += 1
-		else:
-			snr.append([1, r])
-		rprev = r
 
-	print(snr)
+@rec.command(name='import')
+@click.argument('infile', type=click.File('r'), default='-')
+@pass_control
+def import_(control, infile):
+	"""Bulk short-form entry from lines of DATE EXERCISE FESTR (default stdin)"""
+	with stage('resolve'):
+		index = load_index(control.dbf)
+
+	n_lines = 0
+	n_rows = 0
+	n_errors = 0
+	failed = False
+	start = time.perf_counter()
+
+	with stage('parse'):
+		rows = []
+		for lineno, line in enumerate(infile, 1):
+			line = line.strip()
+			if not line or line.startswith('#'):
+				continue
+			n_lines += 1
+			try:
+				fields = line.split()
+				if len(fields) != 3:
+					raise ValueError('Expected DATE EXERCISE FESTR, got: ' + line)
+				when = parse_date(fields[0])
+				if fields[1] not in index:
+					raise ValueError('Exercise: ' + fields[1] + ' not in database.')
+				exercise = index[fields[1]]
+				replist, weight, rpe = parse_festr(fields[2])
+			except ValueError as err:
+				print('Line ' + str(lineno) + ':', err, file=sys.stderr)
+				n_errors += 1
+				continue
+
+			for sets, reps in run_lengths(replist):
+				rows.append({
+					RECORD_FIELDNAMES[0]: str(when),
+					RECORD_FIELDNAMES[1]: exercise,
+					RECORD_FIELDNAMES[2]: sets,
+					RECORD_FIELDNAMES[3]: reps,
+					RECORD_FIELDNAMES[4]: weight,
+					RECORD_FIELDNAMES[5]: rpe,
+					RECORD_FIELDNAMES[6]: None
+				})
+			if len(rows) >= IMPORT_BATCH:
+				if not append_rows(control, rows):
+					failed = True
+					break
+				n_rows += len(rows)
+				rows = []
+	# rows the daemon turned down are not counted, and nothing after them is written
+	if not failed and append_rows(control, rows):
+		n_rows += len(rows)
+	else:
+		print('Import stopped, only the first', n_rows, 'rows were recorded.', file=sys.stderr)
+
+	elapsed = time.perf_counter() - start
+	print('Imported', n_rows, 'rows from', n_lines, 'lines,', n_errors, 'errors.')
+	print('{:.3f} s, {:.0f} rows/s'.format(elapsed, n_rows/elapsed if elapsed > 0 else 0.0))
 
-	for x in snr:
-		sets = x[0]
-		reps = x[1]
-		with open(control.dbf, 'r') as dbf, open(control.rf, 'a') as rf:
-			rdr = csv.DictReader(dbf)
-			wtr = csv.DictWriter(rf, fieldnames=RECORD_FIELDNAMES)
 
-			# If we want to enter an exerces, make sure it exists
-			if exercise != None:
-				in_db = False
-				for row in rdr:
-					if (exercise == row['exercise'] or exercise in row['aliases'].split()):
-						exercise = row['exercise']
-						in_db = True
-				if not in_db:
-					print('Exercise:', exercise, 'not in database. Aborting entry.')
-					return 0
-
-			# A number of things are contingent, so if we don't have all we might as well have none
-			if exercise == None or reps == None or weight == None:
-				if exercise !=None or reps != None or weight != None:
-					print('Exercise, reps and weight have to be specified together')
-				exercise = None
-				sets = None
-				reps = None
-				weight = None
-				rpe = None
-
-			if exercise == None and sets == None and reps == None and weight == None and rpe == None and bw == None:
-				print('Nothing to enter.')
-				return 0
-
-			wtr.writerow({
-				RECORD_FIELDNAMES[0]: when,
-				RECORD_FIELDNAMES[1]: exercise,
-				RECORD_FIELDNAMES[2]: sets,
-				RECORD_FIELDNAMES[3]: reps,
-				RECORD_FIELDNAMES[4]: weight,
-				RECORD_FIELDNAMES[5]: rpe,
-				RECORD_FIELDNAMES[6]: bw
-			})
+@rec.command()
+@click.option('--since', type=str, help='First date to include (YYYY-MM-DD).')
+@click.option('--until', type=str, help='Last date to include (YYYY-MM-DD).')
+@click.option('-e', '--exercise', type=str)
+@click.option('-f', '--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'npz']), default='csv')
+@click.option('-o', '--output', type=click.Path(), help='Output file, required for npz (default stdout).')
+@pass_control
+def query(control, since, until, exercise, fmt, output):
+	"""Print the record rows in a date range, optionally for one exercise"""
+	import query as recquery
+
+	try:
+		if since != None:
+			since = str(parse_date(since))
+		if until != None:
+			until = str(parse_date(until))
+	except ValueError as err:
+		print(err)
+		return 0
+
+	if exercise != None:
+		canonical = resolve_exercise(control, exercise)
+		if canonical == None:
+			print('Exercise:', exercise, 'not in database.')
+			return 0
+		exercise = canonical
+
+	ctrl = read_control(control.inf)
+	if fmt == 'npz':
+		if output == None:
+			print('The npz format needs an --output file.')
+			return 0
+		import numpy as np
+		with stage('query'):
+			cols, exercises = recquery.query_columns(ctrl, since, until, exercise)
+			np.savez(output, exercises=np.array(exercises), **cols)
+		return 0
+
+	rows = recquery.query(ctrl, since, until, exercise)
+
+	# rows is a generator, the query runs as it is written out
+	with stage('query'):
+		of = open(output, 'w', newline='') if output != None else sys.stdout
+		try:
+			if fmt == 'csv':
+				wtr = csv.DictWriter(of, fieldnames=RECORD_FIELDNAMES)
+				wtr.writeheader()
+				wtr.writerows(rows)
+			else:
+				for row in rows:
+					of.write(json.dumps(row) + '\n')
+		finally:
+			if output != None:
+				of.close()
+
+
+@rec.command()
+@pass_control
+def compact(control):
+	"""Move the append log into the column files (columnar storage only)"""
+	if control.storage != 'columnar':
+		print('Record storage is', control.storage + ', nothing to compact.')
+		return 0
+	import colstore
+	n_rows = colstore.compact(control.cols, control.rf, control.dbf)
+	print('Compacted', n_rows, 'rows.')
 
 
 
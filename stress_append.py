@@ -0,0 +1,91 @@
+import csv
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from records import RECORD_FIELDNAMES, append_record
+
+
+# Multi-writer stress test for record appends.
+#
+# Several processes append to one record file at the same time, each command
+# adding a batch of rows the way rec fe or rec import does. Afterwards every
+# line is checked to be a complete row, and every writer to have all of its
+# rows present in order.
+
+
+def writer(path, wid, commands, rows):
+    for c in range(commands):
+        batch = [{
+            'date': '2024-01-01',
+            'exercise': 'w' + str(wid),
+            'sets': c,
+            'reps': r,
+            'weight': 100.0,
+            'rpe': None,
+            'bodyweight': None,
+        } for r in range(rows)]
+        with open(path, 'a+b') as rf:
+            append_record(rf, batch)
+    return wid
+
+
+def check(path, writers, commands, rows):
+    """Return a list of problems found in the record"""
+    problems = []
+    seen = {'w' + str(w): [] for w in range(writers)}
+    with open(path, 'r', newline='') as rf:
+        rdr = csv.reader(rf)
+        header = next(rdr)
+        if header != RECORD_FIELDNAMES:
+            problems.append('Bad header: ' + ','.join(header))
+        for lineno, row in enumerate(rdr, 2):
+            if len(row) != len(RECORD_FIELDNAMES) or row[1] not in seen:
+                problems.append('Torn row on line ' + str(lineno) + ': ' + ','.join(row))
+                continue
+            seen[row[1]].append((int(row[2]), int(row[3])))
+    expected = [(c, r) for c in range(commands) for r in range(rows)]
+    for w, got in seen.items():
+        if got != expected:
+            problems.append('Writer ' + w + ' has ' + str(len(got)) + ' rows, out of order or missing')
+    return problems
+
+
+@click.command()
+@click.option('-w', '--writers', type=int, default=8, help='Concurrent writer processes.')
+@click.option('-c', '--commands', type=int, default=500, help='Appends per writer.')
+@click.option('-r', '--rows', type=int, default=4, help='Rows per append.')
+def main(writers, commands, rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'stress.record')
+        with open(path, 'w') as rf:
+            csv.DictWriter(rf, fieldnames=RECORD_FIELDNAMES).writeheader()
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=writers) as executor:
+            list(executor.map(
+                writer, [path]*writers, range(writers), [commands]*writers, [rows]*writers
+            ))
+        elapsed = time.perf_counter() - start
+
+        problems = check(path, writers, commands, rows)
+
+    n_rows = writers*commands*rows
+    print(writers, 'writers,', writers*commands, 'appends,', n_rows, 'rows')
+    print('{:.3f} s, {:.0f} rows/s, {:.0f} appends/s'.format(
+        elapsed, n_rows/elapsed, writers*commands/elapsed
+    ))
+    for problem in problems[:20]:
+        print(problem)
+    if problems:
+        print(len(problems), 'problems.')
+        sys.exit(1)
+    print('Record intact.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+import configparser
+import csv
+import datetime
+import os
+
+import click
+import numpy as np
+import toml
+
+from records import RECORD_FIELDNAMES, DATABASE_FIELDNAMES
+from rngfit import forward_general_epley, round_to
+
+
+# Synthetic training histories.
+#
+# generate() writes a complete set of files for one made up athlete: a
+# setrack control file with its database and record, an rngfit TOML database
+# of AMRAPs and a plan for rngfit parse. Everything is drawn from one seeded
+# generator, so the same arguments always give the same files.
+#
+# Each exercise has a true 1rm that improves with diminishing returns over the
+# years, and a general epley slope. Logged sets and AMRAPs are drawn around the
+# curve that follows from these, with noise. Bodyweight drifts as a slow
+# random walk and is logged on some of the days.
+
+ROUNDING = 2.5
+START = datetime.date(2020, 1, 6)
+
+
+def exercise_name(i):
+    return 'ex{:03d}'.format(i)
+
+
+def generate(outdir, name, years=3, n_exercises=200, n_amrap_exercises=20, per_session=6, seed=0):
+    """Write the files for one athlete, return the control file name"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(outdir, exist_ok=True)
+    base = os.path.join(outdir, name)
+    n_days = 365*years
+
+    # exercise properties, a handful of bodyweight exercises among them
+    start_orm = rng.uniform(40, 200, n_exercises)
+    gain = rng.uniform(0.1, 0.6, n_exercises)
+    slope = rng.uniform(20, 35, n_exercises)
+    bwratio = np.where(rng.random(n_exercises) < 0.1, rng.choice([0.5, 0.7, 1.0], n_exercises), 0.0)
+    popularity = rng.pareto(1.0, n_exercises) + 1
+    popularity /= popularity.sum()
+
+    def true_orm(ex, day):
+        return start_orm[ex]*(1 + gain[ex]*np.log1p(day/365))
+
+    with open(base + '.database', 'w') as dbf:
+        wtr = csv.DictWriter(dbf, fieldnames=DATABASE_FIELDNAMES)
+        wtr.writeheader()
+        for i in range(n_exercises):
+            wtr.writerow({
+                DATABASE_FIELDNAMES[0]: exercise_name(i),
+                DATABASE_FIELDNAMES[1]: 'e{:03d}'.format(i),
+                DATABASE_FIELDNAMES[2]: bwratio[i]
+            })
+
+    bw = 80 + np.cumsum(rng.normal(0, 0.15, n_days)) + np.linspace(0, rng.normal(0, 5), n_days)
+    trains = rng.random(n_days) < 4/7
+    weighs = rng.random(n_days) < 0.5
+    with open(base + '.record', 'w') as rf:
+        wtr = csv.DictWriter(rf, fieldnames=RECORD_FIELDNAMES)
+        wtr.writeheader()
+        for day in range(n_days):
+            date = START + datetime.timedelta(days=day)
+            if weighs[day]:
+                wtr.writerow({'date': date, 'bodyweight': round(bw[day], 1)})
+            if not trains[day]:
+                continue
+            for ex in rng.choice(n_exercises, per_session, replace=False, p=popularity):
+                reps = int(rng.integers(1, 13))
+                in_reserve = rng.integers(0, 4)
+                weight = forward_general_epley(true_orm(ex, day), reps + in_reserve, slope[ex])
+                wtr.writerow({
+                    'date': date,
+                    'exercise': exercise_name(ex),
+                    'sets': int(rng.integers(1, 6)),
+                    'reps': reps,
+                    'weight': float(round_to(weight*rng.normal(1, 0.02), ROUNDING)),
+                    'rpe': 10 - in_reserve if rng.random() < 0.3 else None,
+                })
+
+    # weekly-ish AMRAPs for the most popular exercises
+    db = {'exercises': []}
+    for ex in np.argsort(-popularity)[:n_amrap_exercises]:
+        days = np.sort(rng.choice(n_days, max(2, n_days//9), replace=False))
+        reps = rng.integers(1, 13, len(days))
+        weights = forward_general_epley(true_orm(ex, days), reps, slope[ex])*rng.normal(1, 0.03, len(days))
+        lines = ['date,reps,weight'] + [
+            '{},{},{:.1f}'.format(START + datetime.timedelta(days=int(d)), r, w)
+            for d, r, w in zip(days, reps, weights)
+        ]
+        db['exercises'].append(exercise_name(ex))
+        db[exercise_name(ex)] = {'amraps': '\n'.join(lines) + '\n', 'rounding': ROUNDING}
+    with open(base + '.toml', 'w') as tf:
+        toml.dump(db, tf)
+
+    with open(base + '.plan', 'w') as pf:
+        for week in range(4):
+            pf.write('Week ' + str(week + 1) + '\n')
+            for ex in db['exercises']:
+                pf.write(ex + ' [3x5;r2 5x3;f0.9 4x8;r1] rest 3 min\n')
+
+    ctrl = configparser.ConfigParser()
+    ctrl['RECORD'] = {'filename': base + '.record', 'storage': 'csv'}
+    ctrl['DATABASE'] = {'filename': base + '.database'}
+    ctrl['USERINFO'] = {'name': name}
+    with open(base, 'w') as inf:
+        ctrl.write(inf)
+    return base
+
+
+@click.command()
+@click.argument('outdir', type=click.Path())
+@click.argument('names', type=str, nargs=-1, required=True)
+@click.option('--years', type=int, default=3)
+@click.option('--exercises', type=int, default=200, help='Exercises in the database.')
+@click.option('--amrap-exercises', type=int, default=20, help='Exercises with AMRAPs in the TOML.')
+@click.option('--per-session', type=int, default=6, help='Exercises logged per session.')
+@click.option('--seed', type=int, default=0)
+def main(outdir, names, years, exercises, amrap_exercises, per_session, seed):
+    """Write synthetic histories for athletes NAMES into OUTDIR"""
+    for i, name in enumerate(names):
+        inf = generate(outdir, name, years, exercises, amrap_exercises, per_session, seed + i)
+        print(inf)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import numpy as np
+
+import analyze
+
+
+def never_weighed():
+    """Two days of squats and chin-ups without a single weigh-in"""
+    log = analyze.DailyLog()
+    entries = [
+        ('2024-03-01', 'squat', 3, 5, 100.0, None),
+        ('2024-03-01', 'chinup', 3, 5, 10.0, None),
+        ('2024-03-03', 'squat', 1, 3, 110.0, None),
+    ]
+    analyze.reduce_sets(analyze.split_bodyweight(entries, log), log)
+    return log
+
+
+def test_no_bodyweight_leaves_bwratio_0_alone():
+    log = never_weighed()
+    bw = analyze.fill_bodyweight(log.bw)
+    assert np.isnan(bw).all()
+    daily = analyze.daily_series(log, {'squat': 0.0, 'chinup': 1.0}, bw)
+    np.testing.assert_allclose(daily['squat']['e1rm'], [100*(1 + 5/30), 110*(1 + 3/30)])
+    np.testing.assert_allclose(daily['squat']['volume'], [1500.0, 330.0])
+    # the bodyweight part of a chin-up is unknown
+    assert np.isnan(daily['chinup']['e1rm']).all()
+
+    series = analyze.exercise_series({'squat': 0.0}, [0, 1], daily, 'top', 0, bw)
+    np.testing.assert_allclose(series[0][2], [100.0, 110.0])
@@ -0,0 +1,52 @@
+import csv
+import os
+import subprocess
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(cwd, script, *args, input=''):
+    return subprocess.run(
+        [sys.executable, os.path.join(HERE, script)] + list(args),
+        cwd=cwd, input=input, capture_output=True, text=True
+    )
+
+
+@pytest.fixture
+def team(tmp_path):
+    """team/a and team/b set up from inside team, b with a record row for an exercise not in its database"""
+    team = tmp_path / 'team'
+    team.mkdir()
+    for name in ['a', 'b']:
+        run(team, 'setrack.py', name, 'init', '--username', name)
+        run(team, 'setrack.py', name, 'db', 'entry', 'squat')
+        run(team, 'setrack.py', name, 'rec', 'entry', '--year', '2024', '--month', '3', '--day', '1', '--bw', '80')
+        run(team, 'setrack.py', name, 'rec', 'fe', '--year', '2024', '--month', '3', '--day', '1', 'squat', '3x5x100')
+    with open(team / 'b.record', 'a') as rf:
+        rf.write('2024-03-02,bench,1,5,60.0,,\n')
+    run(team, 'ff.py', 'a', 'export', 'a.npz') # leaves a binary sidecar next to the record
+    return tmp_path
+
+
+def summary(path):
+    with open(path, 'r') as sf:
+        return list(csv.DictReader(sf))
+
+
+def test_bad_athlete_does_not_stop_the_batch(team):
+    res = run(team, 'batch.py', 'team/*', '-o', 'out.csv', '-j', '2')
+    assert res.returncode == 0, res.stderr
+    assert 'team/b: KeyError' in res.stderr
+    assert '2 athletes, 1 summarized, 0 unchanged, 1 failed' in res.stdout
+    # the control files were written inside team, their paths are found from here
+    assert [(x['control'], x['exercise'], x['e1rm']) for x in summary(team / 'out.csv')] == [('team/a', 'squat', '116.67')]
+
+
+def test_missing_files_are_failures(team):
+    os.remove(team / 'team' / 'a.database')
+    res = run(team, 'batch.py', 'team/a', '-o', 'out.csv')
+    assert 'team/a:' in res.stderr
+    assert '1 athletes, 0 summarized, 0 unchanged, 1 failed, 0 other files ignored.' in res.stdout
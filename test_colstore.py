@@ -0,0 +1,84 @@
+import configparser
+import csv
+
+import numpy as np
+
+import colstore
+import query
+from records import RECORD_FIELDNAMES, DATABASE_FIELDNAMES
+
+
+ROWS = [
+    ['2024-01-01', 'squat', '3', '5', '100.0', '8.0', ''],
+    ['2024-01-01', '', '', '', '', '', '80.5'],
+    ['2024-01-03', 'bench', '1', '3', '82.5', '', ''],
+    ['2024-02-10', 'squat', '1', '1', '140.0', '', '81.0'],
+]
+
+
+def control(tmp_path, name, storage):
+    ctrl = configparser.ConfigParser()
+    ctrl['RECORD'] = {'filename': str(tmp_path / (name + '.record')), 'storage': storage}
+    if storage == 'columnar':
+        ctrl['RECORD']['columns'] = str(tmp_path / (name + '.columns'))
+    ctrl['DATABASE'] = {'filename': str(tmp_path / 'x.database')}
+    return ctrl
+
+
+def write_rows(filename, rows, header=False):
+    with open(filename, 'a', newline='') as rf:
+        wtr = csv.writer(rf)
+        if header:
+            wtr.writerow(RECORD_FIELDNAMES)
+        wtr.writerows(rows)
+
+
+def make_records(tmp_path):
+    """The same rows as a CSV record and as a columnar record with some rows still in the log"""
+    with open(tmp_path / 'x.database', 'w', newline='') as dbf:
+        wtr = csv.writer(dbf)
+        wtr.writerow(DATABASE_FIELDNAMES)
+        wtr.writerows([['squat', '', '0.0'], ['bench', '', '0.0']])
+    plain = control(tmp_path, 'plain', 'csv')
+    write_rows(plain['RECORD']['filename'], ROWS, header=True)
+    cols = control(tmp_path, 'cols', 'columnar')
+    write_rows(cols['RECORD']['filename'], ROWS[:3], header=True)
+    colstore.create(cols['RECORD']['columns'], cols['RECORD']['filename'])
+    colstore.compact(cols['RECORD']['columns'], cols['RECORD']['filename'], cols['DATABASE']['filename'])
+    write_rows(cols['RECORD']['filename'], ROWS[3:])
+    return plain, cols
+
+
+def assert_same_columns(a, b):
+    assert set(a) == set(colstore.COLUMNS) == set(b)
+    for name in colstore.COLUMNS:
+        assert a[name].dtype == np.dtype(colstore.COLUMNS[name])
+        assert np.array_equal(a[name], b[name], equal_nan=True), name
+
+
+def test_load_record_is_typed_for_both_backends(tmp_path):
+    plain, cols = make_records(tmp_path)
+    a, exercises = colstore.load_record(plain)
+    b, __ = colstore.load_record(cols)
+    assert exercises == ['squat', 'bench']
+    assert_same_columns(a, b)
+    assert a['exercise'].tolist() == [0, colstore.MISSING_INT, 1, 0]
+    assert np.isnan(a['weight'][1])
+
+
+def test_query_columns_match_rows(tmp_path):
+    plain, cols = make_records(tmp_path)
+    for since, until, exercise in [
+        (None, None, None), ('2024-01-02', None, None), (None, '2024-01-31', 'squat'), (None, None, 'deadlift')
+    ]:
+        a, exercises = query.query_columns(plain, since, until, exercise)
+        b, __ = query.query_columns(cols, since, until, exercise)
+        assert_same_columns(a, b)
+        # the string rows for export are the CSV rows, with floats written out as floats
+        assert list(colstore.iter_rows(b, exercises)) == list(query.query(plain, since, until, exercise))
+
+
+def test_compact_keeps_columns(tmp_path):
+    plain, cols = make_records(tmp_path)
+    colstore.compact(cols['RECORD']['columns'], cols['RECORD']['filename'], cols['DATABASE']['filename'])
+    assert_same_columns(colstore.load_record(plain)[0], colstore.load_record(cols)[0])
@@ -0,0 +1,103 @@
+import csv
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+import daemon
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def setrack(tmp_path, *args, input='', check=False):
+    return subprocess.run(
+        [sys.executable, os.path.join(HERE, 'setrack.py'), 'x'] + list(args),
+        cwd=tmp_path, input=input, capture_output=True, text=True, check=check
+    )
+
+
+@pytest.fixture
+def served(tmp_path):
+    """A scratch control file with squat in the database and a daemon serving it"""
+    setrack(tmp_path, 'init', '--username', 'x', check=True)
+    setrack(tmp_path, 'db', 'entry', 'squat', 'sq', check=True)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'setrack.py'), 'x', 'serve'],
+        cwd=tmp_path, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert proc.stdout.readline().startswith('Listening on')
+        yield tmp_path, str(tmp_path / daemon.socket_filename('x'))
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=10)
+    assert not os.path.exists(tmp_path / daemon.socket_filename('x'))
+
+
+def record_rows(tmp_path):
+    with open(tmp_path / 'x.record', 'r') as rf:
+        return list(csv.DictReader(rf))
+
+
+def test_append_and_query(served):
+    tmp_path, sock = served
+    assert daemon.is_running(sock)
+    assert daemon.request(sock, {'op': 'resolve', 'exercise': 'sq'}) == {'ok': True, 'exercise': 'squat'}
+
+    rows = [
+        {'date': '2024-01-01', 'exercise': 'sq', 'sets': 3, 'reps': 5, 'weight': 100.0},
+        {'date': '2024-01-03', 'exercise': 'squat', 'sets': 1, 'reps': 3, 'weight': 110.0},
+    ]
+    assert daemon.request(sock, {'op': 'append', 'rows': rows}) == {'ok': True, 'rows': 2}
+
+    reply = daemon.request(sock, {'op': 'query', 'since': '2024-01-02'})
+    assert reply['ok']
+    assert [(x['date'], x['exercise'], x['weight']) for x in reply['rows']] == [('2024-01-03', 'squat', '110.0')]
+    assert [x['exercise'] for x in record_rows(tmp_path)] == ['squat', 'squat']
+
+
+def test_rejected_rows_are_not_written(served):
+    tmp_path, sock = served
+    rows = [{'date': '2024-01-01', 'exercise': 'bench', 'sets': 1, 'reps': 5, 'weight': 80.0}]
+    reply = daemon.request(sock, {'op': 'append', 'rows': rows})
+    assert not reply['ok']
+    assert 'bench' in reply['error']
+    assert daemon.request(sock, {'op': 'nonsense'})['ok'] is False
+    assert record_rows(tmp_path) == []
+
+
+def test_rec_commands_go_through_daemon(served):
+    tmp_path, sock = served
+    assert setrack(tmp_path, 'rec', 'fe', 'sq', '5,5,3x100').returncode == 0
+    res = setrack(tmp_path, 'rec', 'import', input='2024-02-01 squat 2x5x90\n2024-02-02 bench 1x1x50\n')
+    assert 'Imported 1 rows from 2 lines, 1 errors.' in res.stdout
+
+    ping = daemon.request(sock, {'op': 'ping'})
+    assert ping['rows'] == 3
+    assert [(x['sets'], x['reps']) for x in record_rows(tmp_path)] == [('2', '5'), ('1', '3'), ('2', '5')]
+
+
+def test_rejected_rows_are_not_counted(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    import setrack as setrack_cli
+
+    setrack(tmp_path, 'init', '--username', 'x', check=True)
+    setrack(tmp_path, 'db', 'entry', 'squat', check=True)
+    monkeypatch.chdir(tmp_path)
+
+    def request(sockpath, message):
+        # a daemon that fails every append
+        if message['op'] == 'append':
+            return {'ok': False, 'error': 'Disk full.'}
+        return None
+    monkeypatch.setattr(daemon, 'request', request)
+
+    res = CliRunner().invoke(setrack_cli.main, ['x', 'rec', 'import'], input='2024-02-01 squat 2x5x90\n')
+    assert 'Daemon error: Disk full.' in res.output
+    assert 'Imported 0 rows from 1 lines' in res.output
+    res = CliRunner().invoke(setrack_cli.main, ['x', 'rec', 'fe', 'squat', '1x5x90'])
+    assert 'Entry not recorded.' in res.output
+    assert record_rows(tmp_path) == []
@@ -0,0 +1,17 @@
+import numpy as np
+
+import ff
+
+
+def test_dates_of_empty_record():
+    agg = ff.new_aggregates()
+    dates = ff.aggregate_dates(agg)
+    assert dates.dtype == np.dtype('datetime64[D]')
+    assert len(dates) == 0
+
+
+def test_dates_follow_first_day():
+    agg = ff.new_aggregates()
+    agg['first_day'] = int(np.datetime64('2024-02-28', 'D').astype(int))
+    agg['work'] = np.zeros((3, 1))
+    assert ff.aggregate_dates(agg).tolist() == np.array(['2024-02-28', '2024-02-29', '2024-03-01'], dtype='datetime64[D]').tolist()
@@ -0,0 +1,45 @@
+import csv
+
+import query
+from records import RECORD_FIELDNAMES
+
+
+def write_record(tmp_path, days=40):
+    rec = str(tmp_path / 'x.record')
+    with open(rec, 'w', newline='') as rf:
+        wtr = csv.writer(rf)
+        wtr.writerow(RECORD_FIELDNAMES)
+        for i in range(days*10):
+            wtr.writerow(['2024-01-{:02d}'.format(1 + i//10 % 28), 'squat', '3', '5', '100.0', '', ''])
+    return rec
+
+
+def counting_crc(monkeypatch):
+    calls = []
+    crc = query.block_crc
+    def counted(*args):
+        calls.append(args[1:])
+        return crc(*args)
+    monkeypatch.setattr(query, 'block_crc', counted)
+    return calls
+
+
+def test_unchanged_record_is_not_read_again(tmp_path, monkeypatch):
+    rec = write_record(tmp_path)
+    blocks = query.load_date_index(rec)
+    calls = counting_crc(monkeypatch)
+    assert query.load_date_index(rec) == blocks
+    assert calls == []
+
+
+def test_same_length_edit_is_noticed(tmp_path, monkeypatch):
+    rec = write_record(tmp_path)
+    query.load_date_index(rec)
+    with open(rec, 'r+b') as rf:
+        rf.seek(len(rf.readline()))
+        rf.write(b'2023')
+    calls = counting_crc(monkeypatch)
+    blocks = query.load_date_index(rec)
+    assert calls
+    assert blocks[0][3] == '2023-01-01'
+    assert list(query.query_csv(rec, until='2023-12-31'))[0]['date'] == '2023-01-01'
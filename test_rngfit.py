@@ -0,0 +1,173 @@
+import json
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+import rngfit
+
+
+def synthetic_amraps(seed, n, orm=150.0, slope=29.0, noise=0.02, days=240):
+    """n AMRAPs on distinct days of a lifter with a true 1rm and slope, with weights off by noise"""
+    rng = np.random.default_rng(seed)
+    dates = np.sort(rng.choice(days, n, replace=False)) + np.datetime64('2023-01-01', 'D')
+    reps = rng.choice(np.arange(1, 13), n, replace=n > 12) # different reps while they last
+    weight = rngfit.forward_general_epley(orm, reps, slope)*rng.normal(1, noise, n)
+    return {'date': dates, 'reps': reps, 'weight': np.round(weight, 1)}
+
+
+AMRAP_SETS = [
+    synthetic_amraps(0, 3),
+    synthetic_amraps(1, 8, orm=100.0, slope=20.0),
+    synthetic_amraps(2, 25, orm=220.0, slope=35.0, noise=0.05),
+    synthetic_amraps(3, 60, days=1000),
+]
+
+
+def iterative(amraps, reference_date=None):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # curve_fit warns when the covariance can't be estimated
+        return rngfit.fit_rmcurve_iterative(amraps, reference_date)
+
+
+@pytest.mark.parametrize('amraps', AMRAP_SETS)
+@pytest.mark.parametrize('reference', [None, '2023-03-01', '2026-01-01'])
+def test_wls_matches_curve_fit(amraps, reference):
+    wls = rngfit.fit_rmcurve_wls(amraps, reference)
+    assert wls is not None
+    np.testing.assert_allclose(wls, iterative(amraps, reference), rtol=1e-5)
+
+
+def test_wls_two_amraps_have_no_sigma():
+    amraps = synthetic_amraps(4, 2)
+    wls = rngfit.fit_rmcurve_wls(amraps)
+    np.testing.assert_allclose(wls[:2], iterative(amraps)[:2], rtol=1e-6)
+    assert wls[2:] == (np.inf, np.inf)
+
+
+def test_wls_degenerate_is_none():
+    amraps = synthetic_amraps(5, 4)
+    amraps['weight'][:] = 100.0
+    assert rngfit.fit_rmcurve_wls(amraps) is None
+
+
+def looped_sweep(amraps, future, solver):
+    """What fit_rmcurve_sweep replaces, one fit_rmcurve per sweep date or per prefix"""
+    dates = rngfit.sweep_dates(amraps, future)
+    if dates is not None:
+        return np.array([rngfit.fit_rmcurve(amraps, d, solver) for d in dates])
+    fits = [[np.nan]*4] + [
+        rngfit.fit_rmcurve({k: v[:j + 1] for k, v in amraps.items()}, solver=solver)
+        for j in range(1, len(amraps['date']))
+    ]
+    return np.array(fits)
+
+
+# the first two AMRAPs share their weight, so the two point prefix falls back to curve_fit
+REPEATED = synthetic_amraps(6, 12, days=90)
+REPEATED['weight'][1] = REPEATED['weight'][0]
+
+
+@pytest.mark.parametrize('amraps', AMRAP_SETS[:3] + [REPEATED])
+@pytest.mark.parametrize('future', [True, False])
+@pytest.mark.parametrize('solver', ['wls', 'iterative'])
+def test_sweep_matches_loop(amraps, future, solver):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        swept = rngfit.fit_rmcurve_sweep(amraps, rngfit.sweep_dates(amraps, future), solver)
+        looped = looped_sweep(amraps, future, solver)
+    assert swept.shape == looped.shape
+    np.testing.assert_allclose(swept, looped, rtol=1e-9)
+
+
+def test_fit_cache_hits_read_only_their_entry(tmp_path):
+    cache = rngfit.FitCache(str(tmp_path / 'x.fitcache'), max_entries=3)
+    keys = [cache.key(str(i), {'fit': 'latest'}) for i in range(5)]
+    assert cache.get(keys[0]) is None
+    for i, k in enumerate(keys):
+        cache.put(k, 'squat', [float(i)]*4)
+        os.utime(cache.filename(k), (i, i)) # in order of use
+    cache.evict()
+    assert len(cache.entries()) == 3
+
+    cache = rngfit.FitCache(str(tmp_path / 'x.fitcache'), max_entries=3)
+    with open(cache.filename(keys[4]), 'rb') as cf:
+        before = cf.read()
+    assert cache.get(keys[4]) == [4.0]*4
+    assert cache.get(keys[0]) is None
+    cache.evict() # nothing was put, so nothing is listed or removed
+    assert (cache.hits, cache.misses) == (1, 1)
+    with open(cache.filename(keys[4]), 'rb') as cf:
+        assert cf.read() == before
+    assert cache.entries()[-1] == cache.filename(keys[4])
+
+
+def test_fit_cache_replaces_single_file_cache(tmp_path):
+    dirname = str(tmp_path / 'x.fitcache')
+    with open(dirname, 'w') as cf:
+        cf.write('{"clock": 0, "entries": {}}')
+    cache = rngfit.FitCache(dirname)
+    assert cache.get('0'*40) is None
+    cache.put('0'*40, 'squat', [1.0, 2.0, 3.0, 4.0])
+    assert rngfit.FitCache(dirname).get('0'*40) == [1.0, 2.0, 3.0, 4.0]
+
+
+def write_db(tmp_path, n=4):
+    dbfile = str(tmp_path / 'x.toml')
+    amraps = synthetic_amraps(7, n)
+    lines = ['date,reps,weight'] + ['{},{},{}'.format(*x) for x in zip(amraps['date'], amraps['reps'], amraps['weight'])]
+    with open(dbfile, 'w') as tf:
+        tf.write('exercises = [ "squat",]\n\n[squat]\namraps = """' + '\n'.join(lines) + '\n"""\nrounding = 2.5\n')
+    return dbfile
+
+
+def test_amraps_entered_while_loading_are_not_lost(tmp_path):
+    dbfile = write_db(tmp_path)
+    db, state = rngfit.load_db(dbfile)
+    rngfit.append_journal(dbfile, {'exercise': 'squat', 'date': '2024-01-01', 'reps': 5, 'weight': 100.0})
+    amraps = rngfit.load_amraps(dbfile, db, state)
+    assert len(amraps['squat']['date']) == 4 # as in db
+
+    db, state = rngfit.load_db(dbfile)
+    assert len(rngfit.load_amraps(dbfile, db, state)['squat']['date']) == 5
+    # and now from the sidecar
+    amraps = rngfit.load_amraps(dbfile, db, state)
+    assert len(amraps['squat']['date']) == 5
+    assert amraps['squat']['weight'][-1] == 100.0
+
+
+def test_touched_database_keeps_its_sidecar(tmp_path):
+    dbfile = write_db(tmp_path)
+    db, state = rngfit.load_db(dbfile)
+    rngfit.load_amraps(dbfile, db, state)
+    os.utime(dbfile, ns=(0, 0))
+    db, state = rngfit.load_db(dbfile)
+    npyfile, metafile = rngfit.sidecar_filenames(dbfile)
+    before = os.stat(npyfile).st_mtime_ns
+    assert len(rngfit.load_amraps(dbfile, db, state)['squat']['date']) == 4
+    assert os.stat(npyfile).st_mtime_ns == before
+    with open(metafile, 'r') as mf:
+        assert json.load(mf)['stamp'] == state['stamp']
+    assert not os.path.exists(metafile + '.tmp')
+
+
+def test_rm_tables_fit_during_an_entry_are_out_of_date(tmp_path, monkeypatch):
+    control = rngfit.Control()
+    control.dbfile = write_db(tmp_path)
+    control.solver = 'wls'
+    control.jobs = 1
+    control.cachedir = control.dbfile + '.fitcache'
+    control.cache_size = 0
+
+    fit = rngfit.cached_fits
+    def fit_while_entering(*args, **kwargs):
+        rngfit.append_journal(control.dbfile, {'exercise': 'squat', 'date': '2024-01-01', 'reps': 5, 'weight': 100.0})
+        return fit(*args, **kwargs)
+    monkeypatch.setattr(rngfit, 'cached_fits', fit_while_entering)
+    rngfit.rm_tables(control)
+    assert rngfit.load_rm_tables(control.dbfile) is None
+
+    monkeypatch.setattr(rngfit, 'cached_fits', fit)
+    tables = rngfit.rm_tables(control)
+    assert rngfit.load_rm_tables(control.dbfile) == tables